@@ -5,11 +5,155 @@ Shows how RASA can enhance the insights engine with dialog management
 """
 
 import asyncio
-import json
-from typing import Dict, Any, List
+import os
+import sys
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Optional
+
+import httpx
 
 # Simulating the integration between RASA MCP and Conversational Analytics
 
+try:
+    import orjson
+
+    def _json(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    import json
+
+    def _json(obj: Any) -> str:
+        return json.dumps(obj, indent=2)
+
+# Set DEMO_VERBOSE=1 to dump the full extracted entity JSON
+_DEBUG = os.environ.get("DEMO_VERBOSE") == "1"
+
+# Intent names, interned so per-turn dispatch lookups compare by identity
+_INTENT_QUERY_PATIENT_LABS = sys.intern("query_patient_labs")
+_INTENT_MEDICATION_ADHERENCE = sys.intern("medication_adherence")
+_INTENT_APPOINTMENT_SCHEDULING = sys.intern("appointment_scheduling")
+
+# Condition name -> ICD codes (keys already case-folded)
+_CONDITION_CODES: Dict[str, Tuple[str, ...]] = {
+    "diabetes": ("E11.9", "E10.9"),
+    "hypertension": ("I10", "I11.9"),
+    "heart disease": ("I25.9", "I50.9")
+}
+
+# Lab name -> LOINC code (keys already case-folded)
+_LAB_CODES: Dict[str, str] = {
+    "hba1c": "4548-4",
+    "glucose": "2339-0",
+    "cholesterol": "2093-3",
+    "blood pressure": "55284-4"
+}
+
+# Follow-up suggestions per intent (tuples, safe to share across calls)
+_FOLLOW_UPS: Dict[str, Tuple[str, ...]] = {
+    _INTENT_QUERY_PATIENT_LABS: (
+        "Would you like to see the trend over time?",
+        "Should I include medication adherence data?",
+        "Do you want to compare with control targets?"
+    ),
+    _INTENT_MEDICATION_ADHERENCE: (
+        "Would you like to see refill patterns?",
+        "Should I check for drug interactions?",
+        "Do you want to see cost analysis?"
+    )
+}
+_DEFAULT_FOLLOW_UPS: Tuple[str, ...] = ("Would you like more details?",)
+
+# Query type per intent
+_QUERY_TYPES: Dict[str, str] = {
+    _INTENT_QUERY_PATIENT_LABS: "Clinical Monitoring",
+    _INTENT_MEDICATION_ADHERENCE: "Medication Management",
+    _INTENT_APPOINTMENT_SCHEDULING: "Care Coordination"
+}
+
+# Intent -> SQL template
+_SQL_TEMPLATES: Dict[str, str] = {
+    _INTENT_QUERY_PATIENT_LABS: """
+                WITH diabetic_patients AS (
+                    SELECT DISTINCT patient_id
+                    FROM conditions
+                    WHERE code IN ({condition_codes})
+                ),
+                recent_labs AS (
+                    SELECT 
+                        p.patient_id,
+                        p.name,
+                        o.code,
+                        o.value,
+                        o.unit,
+                        o.date,
+                        CASE 
+                            WHEN o.code = '4548-4' AND o.value > 7.0 THEN 'Uncontrolled'
+                            WHEN o.code = '2339-0' AND o.value > 180 THEN 'High'
+                            ELSE 'Controlled'
+                        END as control_status
+                    FROM observations o
+                    JOIN patients p ON o.patient_id = p.patient_id
+                    WHERE o.patient_id IN (SELECT patient_id FROM diabetic_patients)
+                        AND o.code IN ({lab_codes})
+                        AND o.date >= CURRENT_DATE - INTERVAL '30 days'
+                )
+                SELECT 
+                    patient_id,
+                    name,
+                    code as test_type,
+                    value,
+                    unit,
+                    date,
+                    control_status
+                FROM recent_labs
+                WHERE control_status = 'Uncontrolled'
+                ORDER BY value DESC
+            """,
+    
+    _INTENT_MEDICATION_ADHERENCE: """
+                SELECT 
+                    p.patient_id,
+                    p.name,
+                    m.medication,
+                    m.last_filled,
+                    m.days_supply,
+                    m.adherence_rate
+                FROM patients p
+                JOIN medication_adherence m ON p.patient_id = m.patient_id
+                WHERE m.adherence_rate < 0.8
+                ORDER BY m.adherence_rate
+            """
+}
+_DEFAULT_SQL = "SELECT * FROM patients LIMIT 10"
+
+def _split_template(sql: str) -> Tuple[str, ...]:
+    """Split a template around its code placeholders into static fragments"""
+    if "{condition_codes}" not in sql:
+        return (sql,)
+    pre, _, rest = sql.partition("{condition_codes}")
+    mid, _, suf = rest.partition("{lab_codes}")
+    return (pre, mid, suf)
+
+# Static SQL fragments per intent, split once at import
+_TEMPLATE_PARTS: Dict[str, Tuple[str, ...]] = {
+    intent: _split_template(sql) for intent, sql in _SQL_TEMPLATES.items()
+}
+_DEFAULT_TEMPLATE_PARTS = (_DEFAULT_SQL,)
+
+@lru_cache(maxsize=512)
+def _quote_join(codes: Tuple[str, ...]) -> str:
+    """Quote and join codes for an SQL IN list, memoized per code set"""
+    return "'" + "','".join(codes) + "'" if codes else "NULL"
+
+@lru_cache(maxsize=256)
+def _render_sql(intent: str, condition_codes: Tuple[str, ...], lab_codes: Tuple[str, ...]) -> str:
+    """Render the SQL template for an intent, memoized per entity code set"""
+    parts = _TEMPLATE_PARTS.get(intent, _DEFAULT_TEMPLATE_PARTS)
+    if len(parts) == 1:
+        return parts[0]
+    pre, mid, suf = parts
+    return "".join((pre, _quote_join(condition_codes), mid, _quote_join(lab_codes), suf))
+
 class ConversationalAnalyticsWithRASA:
     """
     Integration example showing how RASA enhances conversational analytics
@@ -18,6 +162,21 @@ class ConversationalAnalyticsWithRASA:
     def __init__(self):
         self.rasa_endpoint = "http://localhost:8091"  # RASA MCP Server
         self.analytics_endpoint = "http://localhost:8080"  # Conversational Analytics
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    async def __aenter__(self) -> "ConversationalAnalyticsWithRASA":
+        # One pooled HTTP/2 client reused across all turns and helpers
+        self._client = httpx.AsyncClient(
+            base_url=self.rasa_endpoint,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16)
+        )
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def analyze_patient_query_with_dialog(self, query: str) -> Dict[str, Any]:
         """
@@ -25,29 +184,19 @@ class ConversationalAnalyticsWithRASA:
         before generating SQL insights
         """
         
-        print(f"\n=== Analyzing Query with RASA Dialog Management ===")
-        print(f"Original Query: {query}")
-        
         # Step 1: Extract entities and intent using RASA
         entities = await self.extract_medical_context(query)
-        print(f"\nExtracted Medical Context:")
-        print(f"- Intent: {entities['intent']['name']} (confidence: {entities['intent']['confidence']})")
-        print(f"- Entities: {json.dumps(entities['entities'], indent=2)}")
         
-        # Step 2: Enhance query with extracted context
-        enhanced_query = await self.enhance_query_with_context(query, entities)
-        print(f"\nEnhanced Query: {enhanced_query}")
+        # Step 2: Enhance query with extracted context, and
+        # Step 4: Analyze conversation for additional insights
+        # (both only depend on the extracted context, so run them together)
+        enhanced_query, conversation_insights = await asyncio.gather(
+            self.enhance_query_with_context(query, entities),
+            self.analyze_conversation_pattern(query, entities)
+        )
         
         # Step 3: Generate SQL with enhanced context
         sql_result = await self.generate_insights_sql(enhanced_query, entities)
-        print(f"\nGenerated SQL:")
-        print(sql_result['sql'])
-        
-        # Step 4: Analyze conversation for additional insights
-        conversation_insights = await self.analyze_conversation_pattern(query, entities)
-        print(f"\nConversation Insights:")
-        print(f"- Query Type: {conversation_insights['query_type']}")
-        print(f"- Recommended Follow-ups: {conversation_insights['follow_ups']}")
         
         return {
             "original_query": query,
@@ -57,13 +206,37 @@ class ConversationalAnalyticsWithRASA:
             "conversation_insights": conversation_insights
         }
     
+    def print_analysis(self, result: Dict[str, Any]) -> None:
+        """Print the result of analyze_patient_query_with_dialog"""
+        
+        entities = result['medical_context']
+        conversation_insights = result['conversation_insights']
+        
+        print(f"\n=== Analyzing Query with RASA Dialog Management ===")
+        print(f"Original Query: {result['original_query']}")
+        
+        print(f"\nExtracted Medical Context:")
+        print(f"- Intent: {entities['intent']['name']} (confidence: {entities['intent']['confidence']})")
+        if _DEBUG:
+            print(f"- Entities: {_json(entities['entities'])}")
+        
+        print(f"\nEnhanced Query: {result['enhanced_query']}")
+        
+        print(f"\nGenerated SQL:")
+        print(result['sql_result']['sql'])
+        
+        print(f"\nConversation Insights:")
+        print(f"- Query Type: {conversation_insights['query_type']}")
+        print(f"- Recommended Follow-ups: {list(conversation_insights['follow_ups'])}")
+    
     async def extract_medical_context(self, text: str) -> Dict[str, Any]:
         """Use RASA to extract medical entities and intent"""
         
-        # Simulate RASA MCP call
+        # Simulate RASA MCP call; a live integration would reuse the pooled
+        # client, e.g. await self._client.post("/parse", json={"text": text})
         return {
             "intent": {
-                "name": "query_patient_labs",
+                "name": sys.intern("query_patient_labs"),
                 "confidence": 0.92
             },
             "entities": {
@@ -80,26 +253,25 @@ class ConversationalAnalyticsWithRASA:
         # Build enhanced query based on entities
         entities = context['entities']
         
-        enhanced_parts = []
+        parts = [query]
         
         # Add condition context
-        if entities.get('condition'):
-            enhanced_parts.append(f"for patients with {' and '.join(entities['condition'])}")
+        if (conditions := entities.get('condition')):
+            parts.append("for patients with " + " and ".join(conditions))
         
         # Add test type specifics
-        if entities.get('test_type'):
-            enhanced_parts.append(f"specifically {' and '.join(entities['test_type'])} tests")
+        if (test_types := entities.get('test_type')):
+            parts.append("specifically " + " and ".join(test_types) + " tests")
         
         # Add temporal context
-        if entities.get('time_reference'):
-            enhanced_parts.append(f"from {entities['time_reference'][0]}")
+        if (time_reference := entities.get('time_reference')):
+            parts.append(f"from {time_reference[0]}")
         
         # Add severity context
-        if entities.get('severity'):
-            enhanced_parts.append(f"with {entities['severity'][0]} values")
+        if (severity := entities.get('severity')):
+            parts.append(f"with {severity[0]} values")
         
-        enhanced = f"{query} {' '.join(enhanced_parts)}"
-        return enhanced
+        return " ".join(parts)
     
     async def generate_insights_sql(self, query: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Generate SQL using conversational analytics with RASA context"""
@@ -108,69 +280,11 @@ class ConversationalAnalyticsWithRASA:
         intent = context['intent']['name']
         entities = context['entities']
         
-        sql_templates = {
-            "query_patient_labs": """
-                WITH diabetic_patients AS (
-                    SELECT DISTINCT patient_id
-                    FROM conditions
-                    WHERE code IN ({condition_codes})
-                ),
-                recent_labs AS (
-                    SELECT 
-                        p.patient_id,
-                        p.name,
-                        o.code,
-                        o.value,
-                        o.unit,
-                        o.date,
-                        CASE 
-                            WHEN o.code = '4548-4' AND o.value > 7.0 THEN 'Uncontrolled'
-                            WHEN o.code = '2339-0' AND o.value > 180 THEN 'High'
-                            ELSE 'Controlled'
-                        END as control_status
-                    FROM observations o
-                    JOIN patients p ON o.patient_id = p.patient_id
-                    WHERE o.patient_id IN (SELECT patient_id FROM diabetic_patients)
-                        AND o.code IN ({lab_codes})
-                        AND o.date >= CURRENT_DATE - INTERVAL '30 days'
-                )
-                SELECT 
-                    patient_id,
-                    name,
-                    code as test_type,
-                    value,
-                    unit,
-                    date,
-                    control_status
-                FROM recent_labs
-                WHERE control_status = 'Uncontrolled'
-                ORDER BY value DESC
-            """,
-            
-            "medication_adherence": """
-                SELECT 
-                    p.patient_id,
-                    p.name,
-                    m.medication,
-                    m.last_filled,
-                    m.days_supply,
-                    m.adherence_rate
-                FROM patients p
-                JOIN medication_adherence m ON p.patient_id = m.patient_id
-                WHERE m.adherence_rate < 0.8
-                ORDER BY m.adherence_rate
-            """
-        }
-        
         # Map entities to codes
         condition_codes = self.map_conditions_to_codes(entities.get('condition', []))
         lab_codes = self.map_labs_to_codes(entities.get('test_type', []))
         
-        sql = sql_templates.get(intent, "SELECT * FROM patients LIMIT 10")
-        sql = sql.format(
-            condition_codes=','.join(f"'{c}'" for c in condition_codes),
-            lab_codes=','.join(f"'{c}'" for c in lab_codes)
-        )
+        sql = _render_sql(intent, tuple(condition_codes), tuple(lab_codes))
         
         return {
             "sql": sql,
@@ -186,70 +300,28 @@ class ConversationalAnalyticsWithRASA:
         
         intent = context['intent']['name']
         
-        # Define follow-up patterns based on intent
-        follow_up_patterns = {
-            "query_patient_labs": [
-                "Would you like to see the trend over time?",
-                "Should I include medication adherence data?",
-                "Do you want to compare with control targets?"
-            ],
-            "medication_adherence": [
-                "Would you like to see refill patterns?",
-                "Should I check for drug interactions?",
-                "Do you want to see cost analysis?"
-            ]
-        }
-        
-        # Determine query type
-        query_types = {
-            "query_patient_labs": "Clinical Monitoring",
-            "medication_adherence": "Medication Management",
-            "appointment_scheduling": "Care Coordination"
-        }
-        
         return {
-            "query_type": query_types.get(intent, "General Query"),
-            "follow_ups": follow_up_patterns.get(intent, ["Would you like more details?"]),
+            "query_type": _QUERY_TYPES.get(intent, "General Query"),
+            "follow_ups": _FOLLOW_UPS.get(intent, _DEFAULT_FOLLOW_UPS),
             "conversation_depth": 1,
             "requires_clinical_context": True
         }
     
     def map_conditions_to_codes(self, conditions: List[str]) -> List[str]:
         """Map condition names to ICD codes"""
-        condition_map = {
-            "diabetes": ["E11.9", "E10.9"],
-            "hypertension": ["I10", "I11.9"],
-            "heart disease": ["I25.9", "I50.9"]
-        }
-        
-        codes = []
-        for condition in conditions:
-            codes.extend(condition_map.get(condition.lower(), []))
-        
-        return codes
+        return [
+            code
+            for condition in conditions
+            for code in _CONDITION_CODES.get(condition.casefold(), ())
+        ]
     
     def map_labs_to_codes(self, labs: List[str]) -> List[str]:
         """Map lab names to LOINC codes"""
-        lab_map = {
-            "hba1c": "4548-4",
-            "glucose": "2339-0",
-            "cholesterol": "2093-3",
-            "blood pressure": "55284-4"
-        }
-        
-        codes = []
-        for lab in labs:
-            code = lab_map.get(lab.lower())
-            if code:
-                codes.append(code)
-        
-        return codes
+        return [code for lab in labs if (code := _LAB_CODES.get(lab.casefold()))]
 
 async def demo_rasa_enhanced_analytics():
     """Demonstrate RASA-enhanced conversational analytics"""
     
-    analytics = ConversationalAnalyticsWithRASA()
-    
     # Example queries that benefit from RASA understanding
     queries = [
         "Show me patients with uncontrolled diabetes who had high glucose readings last month",
@@ -257,9 +329,19 @@ async def demo_rasa_enhanced_analytics():
         "Find all diabetic patients who missed their recent HbA1c tests"
     ]
     
-    for query in queries:
-        result = await analytics.analyze_patient_query_with_dialog(query)
-        print("\n" + "="*60 + "\n")
+    async with ConversationalAnalyticsWithRASA() as analytics:
+        # Queries are independent, so overlap their I/O (at most 4 in flight);
+        # analysis only returns data, so the reports print in query order
+        semaphore = asyncio.Semaphore(4)
+        
+        async def analyze(query: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await analytics.analyze_patient_query_with_dialog(query)
+        
+        results = await asyncio.gather(*(analyze(query) for query in queries))
+        for result in results:
+            analytics.print_analysis(result)
+            print("\n" + "="*60 + "\n")
 
 async def demo_multi_turn_conversation():
     """Demonstrate multi-turn conversation with context"""
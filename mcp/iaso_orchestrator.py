@@ -5,18 +5,109 @@ Intelligent agent that coordinates multiple medical AI services
 """
 
 import asyncio
-import json
+import hashlib
 import os
+import random
 import re
-from typing import Any, Dict, List, Optional, Set
-from datetime import datetime
+import sys
+import time
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+from datetime import datetime, timezone
 from enum import Enum
 
 import httpx
+import orjson
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 from pydantic import BaseModel
 
+from shared.http_client import request_with_retry
+
+# RunPod serverless API
+RUNPOD_API_BASE = "https://api.runpod.ai/v2"
+TERMINAL_JOB_STATUSES = frozenset({"COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT"})
+JOB_POLL_INITIAL_DELAY = 0.5
+JOB_POLL_MAX_DELAY = 5.0
+# Jobs still queued or running after this are cancelled, so a job stuck
+# IN_QUEUE (no GPU, endpoint scaled to zero) can't hold a concurrency slot
+JOB_TIMEOUT_SECONDS = float(os.getenv("IASO_JOB_TIMEOUT", "300"))
+
+# Transient RunPod failures are retried with jittered exponential backoff
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_JITTER = 0.25
+# Cap on jobs in flight so a fanned-out workflow can't flood an endpoint
+RUNPOD_MAX_CONCURRENCY = int(os.getenv("RUNPOD_MAX_CONCURRENCY", "8"))
+
+# Successful service results are reused for identical calls
+CALL_CACHE_MAX_ENTRIES = 1024
+CALL_CACHE_TTL_SECONDS = float(os.getenv("IASO_CALL_CACHE_TTL", "3600"))
+
+# Serverless workers scale to zero after idling; ping endpoints that haven't
+# seen a real call within this window so the next request lands warm (0 = off)
+KEEPALIVE_INTERVAL_SECONDS = float(os.getenv("IASO_KEEPALIVE_INTERVAL", "240"))
+
+# RunPod endpoint per service: (environment variable, default endpoint ID)
+SERVICE_ENDPOINTS: Dict[str, Tuple[str, str]] = {
+    "whisper": ("WHISPER_ENDPOINT_ID", "rntxttrdl8uv3i"),
+    "phi4": ("PHI4_ENDPOINT_ID", "tmmwa4q8ax5sg4")
+}
+
+@dataclass(frozen=True)
+class Config:
+    """RunPod settings, read from the environment once at startup"""
+    api_key: Optional[str]
+    endpoints: Dict[str, str]
+    
+    @classmethod
+    def from_env(cls) -> "Config":
+        return cls(
+            api_key=os.getenv("RUNPOD_API_KEY"),
+            endpoints={
+                service_id: os.getenv(env_var, default)
+                for service_id, (env_var, default) in SERVICE_ENDPOINTS.items()
+            }
+        )
+
+# Final answer section of Phi-4 reasoning output
+SOLUTION_TAG_RE = re.compile(r'<solution>(.*?)</solution>', re.DOTALL)
+
+# Combined Phi-4 prompt: several analyses of one text share a single prefill.
+# Each task maps to its result key and the section the model must fill in
+MULTI_TASK_SECTIONS: Dict[str, Tuple[str, str]] = {
+    "insights": (
+        "medical_insights",
+        "1. Chief complaint and key symptoms\n"
+        "2. Medical findings and observations\n"
+        "3. Relevant medications with dosages\n"
+        "4. Clinical assessment and diagnosis considerations\n"
+        "5. Recommended follow-up actions\n"
+        "6. Any urgent concerns or red flags"
+    ),
+    "summary": (
+        "clinical_summary",
+        "Concise clinical summary: chief complaint, key findings (with all "
+        "measurements and test results), assessment, treatment plan and follow-up"
+    )
+}
+MULTI_TASK_SECTION_RE = re.compile(r'<(insights|summary)>(.*?)</\1>', re.DOTALL)
+MULTI_TASK_PROMPT = """<|system|>
+You are an expert medical documentation assistant. Complete every requested section for the same encounter, using active voice and exact terminology from the source.
+<|end|>
+<|user|>
+Analyze this medical encounter:
+
+{text}
+
+Respond with each section wrapped in its own tags, EXACTLY like this:
+
+{sections}
+<|end|>
+<|assistant|>"""
+
 class ServiceCapability(Enum):
     """Available service capabilities"""
     TRANSCRIPTION = "transcription"
@@ -31,6 +122,41 @@ class ServiceCapability(Enum):
     ENTITY_EXTRACTION = "entity_extraction"
     CONVERSATION_ANALYSIS = "conversation_analysis"
 
+# Mapping of outputs to capabilities and required inputs
+OUTPUT_MAPPINGS: Dict[str, Dict[str, Any]] = {
+    "transcription": {
+        "capability": ServiceCapability.TRANSCRIPTION,
+        "required_inputs": ["audio_url"],
+        "outputs": ["transcription", "language"]
+    },
+    "soap_note": {
+        "capability": ServiceCapability.SOAP_GENERATION,
+        "required_inputs": ["transcription"],
+        "outputs": ["soap_note"]
+    },
+    "clinical_summary": {
+        "capability": ServiceCapability.CLINICAL_SUMMARY,
+        "required_inputs": ["transcription"],
+        "outputs": ["clinical_summary"]
+    },
+    "medical_insights": {
+        "capability": ServiceCapability.MEDICAL_REASONING,
+        "required_inputs": ["transcription"],
+        "outputs": ["medical_insights", "diagnoses", "medications"]
+    }
+}
+
+# Reverse index: every producible output -> the mapping that produces it
+OUTPUT_PRODUCERS: Dict[str, str] = {
+    produced: key
+    for key, mapping in OUTPUT_MAPPINGS.items()
+    for produced in mapping["outputs"]
+}
+
+def _utcnow_iso() -> str:
+    """Timezone-aware UTC timestamp for workflow responses"""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
 class ServiceRegistry:
     """Registry of available medical services"""
     
@@ -65,95 +191,211 @@ class ServiceRegistry:
             }
             # Future services can be added here
         }
+        
+        # Constant-time "does this service provide X" checks
+        for service in self.services.values():
+            service["capabilities"] = frozenset(service["capabilities"])
+        
+        # Reverse index of active services by capability
+        self._by_capability: Dict[ServiceCapability, List[str]] = defaultdict(list)
+        for service_id, service in self.services.items():
+            if service["status"] == "active":
+                for capability in ServiceCapability:
+                    if capability in service["capabilities"]:
+                        self._by_capability[capability].append(service_id)
     
     def get_services_for_capability(self, capability: ServiceCapability) -> List[str]:
         """Get services that provide a specific capability"""
-        return [
-            service_id 
-            for service_id, service in self.services.items()
-            if capability in service["capabilities"] and service["status"] == "active"
-        ]
+        return self._by_capability.get(capability, [])
     
     def get_service_info(self, service_id: str) -> Optional[Dict]:
         """Get information about a specific service"""
         return self.services.get(service_id)
+    
+    def describe_service(self, service_id: str) -> Dict[str, Any]:
+        """JSON-ready service info, capabilities listed in declaration order"""
+        service = self.services[service_id]
+        return {
+            **service,
+            "capabilities": [cap.value for cap in ServiceCapability if cap in service["capabilities"]]
+        }
 
 class WorkflowPlanner:
     """Plans multi-step workflows based on requirements"""
     
     def __init__(self, registry: ServiceRegistry):
         self.registry = registry
+        # (target output, available inputs) -> mapping keys to run, in order
+        self._resolve_memo: Dict[Tuple[str, FrozenSet[str]], Tuple[str, ...]] = {}
+    
+    def _resolve(self, target: str, have: FrozenSet[str]) -> Tuple[str, ...]:
+        """Mapping keys needed to produce ``target`` from ``have``, prerequisites first"""
+        if target in have:
+            return ()
+        memo_key = (target, have)
+        cached = self._resolve_memo.get(memo_key)
+        if cached is not None:
+            return cached
+        
+        # Explicit worklist instead of recursion: the front output's mapping
+        # is emitted once every input is available or already produced
+        chain: Dict[str, None] = {}
+        expanded: Set[str] = set()
+        worklist = deque([target])
+        while worklist:
+            output = worklist[0]
+            key = OUTPUT_PRODUCERS.get(output)
+            if output in have or key in chain:
+                worklist.popleft()
+                continue
+            if key is None:
+                raise ValueError(f"Cannot produce required output: {output}")
+            
+            pending = [
+                inp for inp in OUTPUT_MAPPINGS[key]["required_inputs"]
+                if inp not in have and OUTPUT_PRODUCERS.get(inp) not in chain
+            ]
+            if not pending:
+                chain[key] = None
+                worklist.popleft()
+            elif key in expanded:
+                # Reached again before its inputs resolved: a cycle
+                raise ValueError(f"Cannot produce required output: {output}")
+            else:
+                expanded.add(key)
+                worklist.extendleft(reversed(pending))
+        
+        resolved = tuple(chain)
+        self._resolve_memo[memo_key] = resolved
+        return resolved
     
     def plan_workflow(self, inputs: Dict[str, Any], required_outputs: List[str]) -> List[Dict[str, Any]]:
-        """Plan a workflow to achieve required outputs from given inputs"""
+        """
+        Plan a workflow to achieve required outputs from given inputs.
+        
+        Steps are returned in dependency order; each step's ``depends_on``
+        lists the indices of the steps producing its inputs, so independent
+        steps can be executed concurrently.
+        """
+        have = frozenset(inputs)
+        
+        # Each resolved chain is closed under its prerequisites, so merging
+        # them in order keeps the combined list topologically sorted
+        needed: Dict[str, None] = {}
+        for output in required_outputs:
+            needed.update(dict.fromkeys(self._resolve(output, have)))
+        
+        # Emit one step per needed mapping
         steps = []
-        available_data = set(inputs.keys())
-        required_data = set(required_outputs)
-        
-        # Determine what we need to produce
-        while required_data - available_data:
-            for output in required_data - available_data:
-                step = self._find_step_for_output(output, available_data)
-                if step:
-                    steps.append(step)
-                    available_data.update(step["outputs"])
-                else:
-                    raise ValueError(f"Cannot produce required output: {output}")
+        producers: Dict[str, int] = {}
+        for key in needed:
+            mapping = OUTPUT_MAPPINGS[key]
+            services = self.registry.get_services_for_capability(mapping["capability"])
+            if not services:
+                raise ValueError(f"Cannot produce required output: {key}")
+            
+            for produced in mapping["outputs"]:
+                producers[produced] = len(steps)
+            steps.append({
+                "service": services[0],
+                "capability": mapping["capability"].value,
+                "inputs": mapping["required_inputs"],
+                "outputs": mapping["outputs"],
+                "depends_on": sorted({
+                    producers[inp] for inp in mapping["required_inputs"] if inp in producers
+                })
+            })
         
         return steps
-    
-    def _find_step_for_output(self, output: str, available_data: Set[str]) -> Optional[Dict[str, Any]]:
-        """Find a service step that can produce the required output"""
-        
-        # Mapping of outputs to capabilities and required inputs
-        output_mappings = {
-            "transcription": {
-                "capability": ServiceCapability.TRANSCRIPTION,
-                "required_inputs": ["audio_url"],
-                "outputs": ["transcription", "language"]
-            },
-            "soap_note": {
-                "capability": ServiceCapability.SOAP_GENERATION,
-                "required_inputs": ["transcription"],
-                "outputs": ["soap_note"]
+
+# MCP tool schemas are constant, so build them once
+_TOOLS: Tuple[Tool, ...] = (
+    Tool(
+        name="process_medical_dictation",
+        description="Process medical dictation from audio to structured documentation",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "audio_url": {
+                    "type": "string",
+                    "description": "URL of medical dictation audio"
+                },
+                "outputs": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": ["transcription", "soap_note", "clinical_summary", "medical_insights"]
+                    },
+                    "description": "Desired outputs",
+                    "default": ["transcription", "soap_note"]
+                },
+                "metadata": {
+                    "type": "object",
+                    "description": "Additional metadata (provider info, patient context, etc.)"
+                }
             },
-            "clinical_summary": {
-                "capability": ServiceCapability.CLINICAL_SUMMARY,
-                "required_inputs": ["transcription"],
-                "outputs": ["clinical_summary"]
+            "required": ["audio_url"]
+        }
+    ),
+    Tool(
+        name="analyze_patient_encounter",
+        description="Comprehensive analysis of patient encounter data",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "encounter_data": {
+                    "type": "object",
+                    "description": "Patient encounter data (can include text, vitals, labs, etc.)"
+                },
+                "analysis_goals": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Specific analysis goals"
+                }
             },
-            "medical_insights": {
-                "capability": ServiceCapability.MEDICAL_REASONING,
-                "required_inputs": ["transcription"],
-                "outputs": ["medical_insights", "diagnoses", "medications"]
+            "required": ["encounter_data"]
+        }
+    ),
+    Tool(
+        name="query_service_capabilities",
+        description="Query available services and their capabilities",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "capability": {
+                    "type": "string",
+                    "description": "Specific capability to search for"
+                }
             }
         }
-        
-        mapping = output_mappings.get(output)
-        if not mapping:
-            return None
-        
-        # Check if we have required inputs
-        if not all(inp in available_data for inp in mapping["required_inputs"]):
-            # Try to get missing inputs first
-            for inp in mapping["required_inputs"]:
-                if inp not in available_data:
-                    prerequisite = self._find_step_for_output(inp, available_data)
-                    if prerequisite:
-                        return prerequisite
-            return None
-        
-        # Find service for this capability
-        services = self.registry.get_services_for_capability(mapping["capability"])
-        if not services:
-            return None
-        
-        return {
-            "service": services[0],
-            "capability": mapping["capability"].value,
-            "inputs": mapping["required_inputs"],
-            "outputs": mapping["outputs"]
+    ),
+    Tool(
+        name="execute_custom_workflow",
+        description="Execute a custom workflow with specified steps",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "inputs": {
+                    "type": "object",
+                    "description": "Initial input data"
+                },
+                "workflow_steps": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "service": {"type": "string"},
+                            "tool": {"type": "string"},
+                            "parameters": {"type": "object"}
+                        }
+                    },
+                    "description": "Custom workflow steps"
+                }
+            },
+            "required": ["inputs", "workflow_steps"]
         }
+    )
+)
 
 class IASOOrchestrator:
     """Intelligent orchestrator for medical AI services"""
@@ -162,6 +404,34 @@ class IASOOrchestrator:
         self.server = Server("iaso-medical-orchestrator")
         self.registry = ServiceRegistry()
         self.planner = WorkflowPlanner(self.registry)
+        self.cfg = Config.from_env()
+        self._auth_headers = {
+            "Authorization": f"Bearer {self.cfg.api_key}",
+            "Content-Type": "application/json"
+        }
+        # Every service call targets api.runpod.ai, so share one pooled
+        # HTTP/2 client instead of paying a TLS handshake per call
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(300.0, connect=10.0),
+            limits=httpx.Limits(
+                max_keepalive_connections=32,
+                max_connections=64,
+                keepalive_expiry=120.0
+            )
+        )
+        self._sem = asyncio.Semaphore(RUNPOD_MAX_CONCURRENCY)
+        # (stored_at, result) by content hash, least recently used first
+        self._call_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Monotonic time of the last job sent to each endpoint
+        self._last_call_ts: Dict[str, float] = {}
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._handlers = {
+            "process_medical_dictation": self.process_medical_dictation,
+            "analyze_patient_encounter": self.analyze_patient_encounter,
+            "query_service_capabilities": self.query_capabilities,
+            "execute_custom_workflow": self.execute_custom_workflow
+        }
         self.setup_tools()
     
     def setup_tools(self):
@@ -169,161 +439,192 @@ class IASOOrchestrator:
         
         @self.server.list_tools()
         async def list_tools() -> List[Tool]:
-            return [
-                Tool(
-                    name="process_medical_dictation",
-                    description="Process medical dictation from audio to structured documentation",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "audio_url": {
-                                "type": "string",
-                                "description": "URL of medical dictation audio"
-                            },
-                            "outputs": {
-                                "type": "array",
-                                "items": {
-                                    "type": "string",
-                                    "enum": ["transcription", "soap_note", "clinical_summary", "medical_insights"]
-                                },
-                                "description": "Desired outputs",
-                                "default": ["transcription", "soap_note"]
-                            },
-                            "metadata": {
-                                "type": "object",
-                                "description": "Additional metadata (provider info, patient context, etc.)"
-                            }
-                        },
-                        "required": ["audio_url"]
-                    }
-                ),
-                Tool(
-                    name="analyze_patient_encounter",
-                    description="Comprehensive analysis of patient encounter data",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "encounter_data": {
-                                "type": "object",
-                                "description": "Patient encounter data (can include text, vitals, labs, etc.)"
-                            },
-                            "analysis_goals": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "Specific analysis goals"
-                            }
-                        },
-                        "required": ["encounter_data"]
-                    }
-                ),
-                Tool(
-                    name="query_service_capabilities",
-                    description="Query available services and their capabilities",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "capability": {
-                                "type": "string",
-                                "description": "Specific capability to search for"
-                            }
-                        }
-                    }
-                ),
-                Tool(
-                    name="execute_custom_workflow",
-                    description="Execute a custom workflow with specified steps",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "inputs": {
-                                "type": "object",
-                                "description": "Initial input data"
-                            },
-                            "workflow_steps": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "service": {"type": "string"},
-                                        "tool": {"type": "string"},
-                                        "parameters": {"type": "object"}
-                                    }
-                                },
-                                "description": "Custom workflow steps"
-                            }
-                        },
-                        "required": ["inputs", "workflow_steps"]
-                    }
-                )
-            ]
+            return list(_TOOLS)
         
         @self.server.call_tool()
         async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
-            if name == "process_medical_dictation":
-                result = await self.process_medical_dictation(arguments)
-            elif name == "analyze_patient_encounter":
-                result = await self.analyze_patient_encounter(arguments)
-            elif name == "query_service_capabilities":
-                result = await self.query_capabilities(arguments)
-            elif name == "execute_custom_workflow":
-                result = await self.execute_custom_workflow(arguments)
+            handler = self._handlers.get(name)
+            if handler:
+                result = await handler(arguments)
             else:
                 result = {"error": f"Unknown tool: {name}"}
             
             return [TextContent(
                 type="text",
-                text=json.dumps(result, indent=2)
+                text=orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
             )]
     
     async def call_service(self, service_id: str, tool: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """Call a specific service tool via RunPod API"""
+        """Call a specific service tool via RunPod API, reusing cached results"""
+        
+        try:
+            cache_key = hashlib.blake2b(
+                orjson.dumps((service_id, tool, parameters), option=orjson.OPT_SORT_KEYS),
+                digest_size=16
+            ).hexdigest()
+        except TypeError:
+            # Parameters that can't be serialized can't be cached either
+            return await self._call_service_uncached(service_id, tool, parameters)
+        
+        cached = self._call_cache.get(cache_key)
+        if cached is not None:
+            stored_at, result = cached
+            if time.monotonic() - stored_at < CALL_CACHE_TTL_SECONDS:
+                self._call_cache.move_to_end(cache_key)
+                return result
+            del self._call_cache[cache_key]
+        
+        result = await self._call_service_uncached(service_id, tool, parameters)
+        
+        # Only cache successes so failed calls are retried
+        if "error" not in result:
+            self._call_cache[cache_key] = (time.monotonic(), result)
+            if len(self._call_cache) > CALL_CACHE_MAX_ENTRIES:
+                self._call_cache.popitem(last=False)
+        
+        return result
+    
+    async def _call_service_uncached(self, service_id: str, tool: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """Submit a service tool call to its RunPod endpoint"""
         
         # Get service configuration
         service_config = self.registry.get_service_info(service_id)
         if not service_config:
             return {"error": f"Unknown service: {service_id}"}
         
-        # Get API key and endpoint IDs from environment
-        api_key = os.getenv("RUNPOD_API_KEY")
-        if not api_key:
+        if not self.cfg.api_key:
             return {"error": "RUNPOD_API_KEY not configured"}
         
-        endpoint_id = None
-        if service_id == "whisper":
-            endpoint_id = os.getenv("WHISPER_ENDPOINT_ID", "rntxttrdl8uv3i")
-        elif service_id == "phi4":
-            endpoint_id = os.getenv("PHI4_ENDPOINT_ID", "tmmwa4q8ax5sg4")
-        
+        endpoint_id = self.cfg.endpoints.get(service_id)
         if not endpoint_id:
             return {"error": f"No endpoint ID configured for service: {service_id}"}
         
-        # Prepare RunPod API call
-        url = f"https://api.runpod.ai/v2/{endpoint_id}/runsync"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        if service_id == "phi4" and tool == "multi_task":
+            tasks = parameters.get("tasks", list(MULTI_TASK_SECTIONS))
+            unknown = [task for task in tasks if task not in MULTI_TASK_SECTIONS]
+            if not tasks or unknown:
+                return {"error": f"multi_task tasks must be a non-empty subset of {list(MULTI_TASK_SECTIONS)}, got {tasks}"}
         
         # Map tool calls to RunPod input format
         payload = self._prepare_service_payload(service_id, tool, parameters)
         
         try:
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                response = await client.post(url, headers=headers, json={"input": payload})
+            async with self._sem:
+                self._last_call_ts[endpoint_id] = time.monotonic()
+                result = await self._submit_and_wait(endpoint_id, self._auth_headers, payload)
+            
+            if result.get("status") == "COMPLETED":
+                output = result.get("output", {})
+                # Extract relevant fields based on service
+                return self._extract_service_response(service_id, tool, output, parameters)
+            else:
+                return {"error": f"Job failed: {result}"}
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("status") == "COMPLETED":
-                        output = result.get("output", {})
-                        # Extract relevant fields based on service
-                        return self._extract_service_response(service_id, tool, output)
-                    else:
-                        return {"error": f"Job failed: {result}"}
-                else:
-                    return {"error": f"HTTP {response.status_code}: {response.text}"}
-                    
-        except Exception as e:
-            return {"error": f"Service call failed: {str(e)}"}
+        except httpx.HTTPStatusError as e:
+            return {"error": f"HTTP {e.response.status_code}: {e.response.text}"}
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            return {"error": f"Service call failed: {e!r}"}
+        except (KeyError, ValueError) as e:
+            # Malformed RunPod response (orjson.JSONDecodeError is a ValueError)
+            return {"error": f"Invalid response from {service_id}: {e!r}"}
+    
+    async def _keepalive_loop(self):
+        """
+        Periodically queue a no-op job on idle endpoints.
+        
+        The handlers load their model before validating input, so an empty
+        job keeps a worker warm and then fails fast without inference.
+        """
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for endpoint_id in self.cfg.endpoints.values():
+                if not endpoint_id:
+                    continue
+                if now - self._last_call_ts.get(endpoint_id, 0.0) < KEEPALIVE_INTERVAL_SECONDS:
+                    continue
+                try:
+                    await self._http.post(
+                        f"{RUNPOD_API_BASE}/{endpoint_id}/run",
+                        headers=self._auth_headers,
+                        content=orjson.dumps({"input": {"ping": True}})
+                    )
+                    self._last_call_ts[endpoint_id] = now
+                except httpx.HTTPError:
+                    # Best effort; the next real call pays the cold start
+                    pass
+    
+    async def _submit_and_wait(self, endpoint_id: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Submit a job via RunPod's async /run API and poll /status until it
+        reaches a terminal state.
+        
+        Unlike /runsync this doesn't hold a pooled connection open for the
+        whole generation, and a cancelled caller also cancels the job. Jobs
+        that don't finish within JOB_TIMEOUT_SECONDS are cancelled and raise
+        asyncio.TimeoutError.
+        """
+        base_url = f"{RUNPOD_API_BASE}/{endpoint_id}"
+        deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+        
+        job = await self._request_json(
+            "POST",
+            f"{base_url}/run",
+            headers,
+            content=orjson.dumps({"input": payload})
+        )
+        job_id = job["id"]
+        
+        delay = JOB_POLL_INITIAL_DELAY
+        try:
+            while job.get("status") not in TERMINAL_JOB_STATUSES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await self._cancel_job(base_url, job_id, headers)
+                    raise asyncio.TimeoutError(
+                        f"RunPod job {job_id} still {job.get('status')} after {JOB_TIMEOUT_SECONDS:g}s"
+                    )
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, JOB_POLL_MAX_DELAY)
+                job = await self._request_json("GET", f"{base_url}/status/{job_id}", headers)
+        except asyncio.CancelledError:
+            await self._cancel_job(base_url, job_id, headers)
+            raise
+        
+        return job
+    
+    async def _cancel_job(self, base_url: str, job_id: str, headers: Dict[str, str]) -> None:
+        """Best-effort cancel of a queued or running job"""
+        try:
+            await self._http.post(f"{base_url}/cancel/{job_id}", headers=headers)
+        except httpx.HTTPError:
+            pass
+    
+    async def _request_json(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        content: Optional[bytes] = None
+    ) -> Dict[str, Any]:
+        """
+        Send a RunPod API request and parse its JSON body, retrying gateway
+        errors and (for /status polls, not job submissions) dropped
+        connections.
+        """
+        response = await request_with_retry(
+            self._http,
+            method,
+            url,
+            delays=[
+                min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) + random.random() * RETRY_JITTER
+                for attempt in range(RETRY_ATTEMPTS - 1)
+            ],
+            headers=headers,
+            content=content
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     def _prepare_service_payload(self, service_id: str, tool: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
         """Prepare payload for specific service"""
@@ -361,10 +662,28 @@ class IASOOrchestrator:
                     "max_tokens": max_tokens,
                     "temperature": 0.7
                 }
+            elif tool == "multi_task":
+                # Unknown prompt types are sent to the model verbatim
+                sections = "\n\n".join(
+                    f"<{task}>\n{MULTI_TASK_SECTIONS[task][1]}\n</{task}>"
+                    for task in parameters.get("tasks", MULTI_TASK_SECTIONS)
+                )
+                return {
+                    "text": MULTI_TASK_PROMPT.format(text=parameters.get("text"), sections=sections),
+                    "prompt_type": "multi",
+                    "max_tokens": 4096,
+                    "temperature": 0.7
+                }
                 
         return parameters
     
-    def _extract_service_response(self, service_id: str, tool: str, output: Dict[str, Any]) -> Dict[str, Any]:
+    def _extract_service_response(
+        self,
+        service_id: str,
+        tool: str,
+        output: Dict[str, Any],
+        parameters: Dict[str, Any]
+    ) -> Dict[str, Any]:
         """Extract relevant fields from service response"""
         
         if service_id == "whisper":
@@ -381,15 +700,37 @@ class IASOOrchestrator:
             text_output = output.get("insights") or output.get("text", "")
             
             if tool == "generate_soap_note":
-                # Parse tags if present
-                import re
-                solution_match = re.search(r'<solution>(.*?)</solution>', text_output, re.DOTALL)
+                # Parse tags if present (skip the regex when there are none)
+                solution_match = SOLUTION_TAG_RE.search(text_output) if "<solution>" in text_output else None
                 soap_note = solution_match.group(1).strip() if solution_match else text_output
                 
                 return {
                     "soap_note": soap_note,
                     "processing_time": output.get("processing_time", 0)
                 }
+            elif tool == "multi_task":
+                processing_time = output.get("processing_time", 0)
+                tasks = parameters.get("tasks", MULTI_TASK_SECTIONS)
+                sections = {
+                    match.group(1): match.group(2).strip()
+                    for match in MULTI_TASK_SECTION_RE.finditer(text_output)
+                }
+                results: Dict[str, Any] = {}
+                missing = []
+                for task in tasks:
+                    result_key = MULTI_TASK_SECTIONS[task][0]
+                    if task in sections:
+                        results[result_key] = {
+                            "result": sections[task],
+                            "processing_time": processing_time
+                        }
+                    else:
+                        missing.append(f"<{task}>")
+                        results[result_key] = {"error": f"Missing <{task}> section in combined response"}
+                if missing:
+                    # Top-level error keeps a partial response out of the call cache
+                    results["error"] = f"Missing {', '.join(missing)} section(s) in combined response"
+                return results
             else:
                 return {
                     "result": text_output,
@@ -400,96 +741,118 @@ class IASOOrchestrator:
     
     async def process_medical_dictation(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Process medical dictation through multiple services"""
+        audio_url = args.get("audio_url")
+        if not audio_url:
+            return {"error": "Missing audio_url", "status": "failed"}
+        desired_outputs = args.get("outputs", ["transcription", "soap_note"])
+        metadata = args.get("metadata", {})
+        
+        # Plan workflow
         try:
-            audio_url = args["audio_url"]
-            desired_outputs = args.get("outputs", ["transcription", "soap_note"])
-            metadata = args.get("metadata", {})
-            
-            # Plan workflow
             workflow = self.planner.plan_workflow(
                 inputs={"audio_url": audio_url},
                 required_outputs=desired_outputs
             )
+        except ValueError as e:
+            return {"error": str(e), "status": "failed"}
+        
+        # Execute workflow as a DAG: each step waits only for the steps
+        # producing its inputs, so independent steps run concurrently
+        results = {}
+        context = {"audio_url": audio_url}
+        tasks: Dict[int, asyncio.Task] = {}
+        
+        async def run_step(step: Dict[str, Any]) -> None:
+            if step["depends_on"]:
+                await asyncio.gather(*(tasks[d] for d in step["depends_on"]))
             
-            # Execute workflow
-            results = {}
-            context = {"audio_url": audio_url}
+            service_id = step["service"]
             
-            for step in workflow:
-                service_id = step["service"]
-                
-                # Determine which tool to call based on capability
-                if step["capability"] == "transcription":
-                    tool = "transcribe_audio"
-                    params = {"audio_url": context["audio_url"]}
-                elif step["capability"] == "soap_generation":
-                    tool = "generate_soap_note"
-                    params = {"text": context["transcription"]}
-                elif step["capability"] == "clinical_summary":
-                    tool = "create_clinical_summary"
-                    params = {"text": context["transcription"]}
-                else:
-                    continue
-                
-                # Call service
-                step_result = await self.call_service(service_id, tool, params)
-                
-                # Update context with results
+            # A failed upstream step leaves its output unset
+            missing = [name for name in step["inputs"] if name not in context]
+            if missing:
                 for output in step["outputs"]:
-                    if output in step_result:
-                        context[output] = step_result[output]
-                        results[output] = step_result[output]
+                    results[output] = {"error": f"Missing input from failed step: {', '.join(missing)}"}
+                return
             
-            return {
-                "status": "completed",
-                "workflow_steps": len(workflow),
-                "results": results,
-                "metadata": metadata,
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            # Determine which tool to call based on capability
+            if step["capability"] == "transcription":
+                tool = "transcribe_audio"
+                params = {"audio_url": context["audio_url"]}
+            elif step["capability"] == "soap_generation":
+                tool = "generate_soap_note"
+                params = {"text": context["transcription"]}
+            elif step["capability"] == "clinical_summary":
+                tool = "create_clinical_summary"
+                params = {"text": context["transcription"]}
+            else:
+                return
             
-        except Exception as e:
-            return {"error": str(e), "status": "failed"}
+            # Call service
+            step_result = await self.call_service(service_id, tool, params)
+            
+            if "error" in step_result:
+                for output in step["outputs"]:
+                    results[output] = step_result
+                return
+            
+            # Update context with results
+            for output in step["outputs"]:
+                if output in step_result:
+                    context[output] = step_result[output]
+                    results[output] = step_result[output]
+        
+        for index, step in enumerate(workflow):
+            tasks[index] = asyncio.create_task(run_step(step))
+        await self._gather_tasks(list(tasks.values()))
+        
+        return {
+            "status": "completed",
+            "workflow_steps": len(workflow),
+            "results": results,
+            "metadata": metadata,
+            "timestamp": _utcnow_iso()
+        }
     
     async def analyze_patient_encounter(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze patient encounter with available services"""
-        try:
-            encounter_data = args["encounter_data"]
-            analysis_goals = args.get("analysis_goals", ["diagnosis", "treatment_plan"])
-            
-            # Determine what services we need based on data and goals
-            results = {}
+        encounter_data = args.get("encounter_data")
+        if not isinstance(encounter_data, dict):
+            return {"error": "encounter_data must be an object", "status": "failed"}
+        analysis_goals = args.get("analysis_goals", ["diagnosis", "treatment_plan"])
+        
+        # Determine what services we need based on data and goals
+        results = {}
+        
+        # If we have text data, use Phi-4 for analysis
+        if "clinical_notes" in encounter_data or "transcription" in encounter_data:
+            text = encounter_data.get("clinical_notes") or encounter_data.get("transcription")
             
-            # If we have text data, use Phi-4 for analysis
-            if "clinical_notes" in encounter_data or "transcription" in encounter_data:
-                text = encounter_data.get("clinical_notes") or encounter_data.get("transcription")
-                
+            if "summary" in analysis_goals:
+                # Insights and summary read the same text: one combined
+                # prompt encodes it once instead of once per analysis
+                combined = await self.call_service(
+                    "phi4",
+                    "multi_task",
+                    {"text": text, "tasks": ["insights", "summary"]}
+                )
+                for key in ("medical_insights", "clinical_summary"):
+                    # A failed call's error applies to both analyses
+                    results[key] = combined.get(key, combined)
+            else:
                 # Get medical insights
-                insights_result = await self.call_service(
+                results["medical_insights"] = await self.call_service(
                     "phi4",
                     "extract_medical_insights",
                     {"text": text, "insight_types": ["symptoms", "diagnoses", "medications"]}
                 )
-                results["medical_insights"] = insights_result
-                
-                # Generate clinical summary if requested
-                if "summary" in analysis_goals:
-                    summary_result = await self.call_service(
-                        "phi4",
-                        "create_clinical_summary",
-                        {"text": text}
-                    )
-                    results["clinical_summary"] = summary_result
-            
-            return {
-                "status": "completed",
-                "analysis_goals": analysis_goals,
-                "results": results,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            return {"error": str(e), "status": "failed"}
+        
+        return {
+            "status": "completed",
+            "analysis_goals": analysis_goals,
+            "results": results,
+            "timestamp": _utcnow_iso()
+        }
     
     async def query_capabilities(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Query available service capabilities"""
@@ -503,7 +866,7 @@ class IASOOrchestrator:
                 return {
                     "capability": capability_filter,
                     "available_services": [
-                        self.registry.get_service_info(s) for s in services
+                        self.registry.describe_service(s) for s in services
                     ]
                 }
             except ValueError:
@@ -511,72 +874,135 @@ class IASOOrchestrator:
         else:
             # Return all services and capabilities
             return {
-                "services": self.registry.services,
+                "services": {
+                    service_id: self.registry.describe_service(service_id)
+                    for service_id in self.registry.services
+                },
                 "capabilities": [cap.value for cap in ServiceCapability]
             }
     
     async def execute_custom_workflow(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a custom workflow"""
-        try:
-            inputs = args["inputs"]
-            workflow_steps = args["workflow_steps"]
+        inputs = args.get("inputs")
+        workflow_steps = args.get("workflow_steps")
+        if not isinstance(inputs, dict) or not isinstance(workflow_steps, list):
+            return {"error": "inputs must be an object and workflow_steps a list", "status": "failed"}
+        for i, step in enumerate(workflow_steps):
+            if not isinstance(step, dict) or "service" not in step or "tool" not in step:
+                return {"error": f"Step {i+1} must define service and tool", "status": "failed"}
+        
+        context = inputs.copy()
+        
+        # Steps only wait for the earlier steps whose results they
+        # reference ("$step_N_result"); independent steps run concurrently
+        producer_index = {f"step_{i+1}_result": i for i in range(len(workflow_steps))}
+        tasks: List[asyncio.Task] = []
+        
+        async def run_step(i: int, step: Dict[str, Any], depends_on: Set[int]) -> Dict[str, Any]:
+            if depends_on:
+                await asyncio.gather(*(tasks[d] for d in depends_on))
             
-            context = inputs.copy()
-            results = []
+            service_id = step["service"]
+            tool = step["tool"]
             
-            for i, step in enumerate(workflow_steps):
-                service_id = step["service"]
-                tool = step["tool"]
-                
-                # Resolve parameters from context
-                params = {}
-                for key, value in step.get("parameters", {}).items():
-                    if isinstance(value, str) and value.startswith("$"):
-                        # Reference to context variable
-                        context_key = value[1:]
-                        params[key] = context.get(context_key)
-                    else:
-                        params[key] = value
-                
-                # Call service
-                step_result = await self.call_service(service_id, tool, params)
-                
-                # Store result
-                results.append({
-                    "step": i + 1,
-                    "service": service_id,
-                    "tool": tool,
-                    "result": step_result
-                })
-                
-                # Update context
-                context[f"step_{i+1}_result"] = step_result
+            # Resolve parameters from context
+            params = {}
+            for key, value in step.get("parameters", {}).items():
+                if isinstance(value, str) and value.startswith("$"):
+                    # Reference to context variable
+                    context_key = value[1:]
+                    params[key] = context.get(context_key)
+                else:
+                    params[key] = value
+            
+            # Call service
+            step_result = await self.call_service(service_id, tool, params)
+            
+            # Update context
+            context[f"step_{i+1}_result"] = step_result
             
             return {
-                "status": "completed",
-                "workflow_steps": len(workflow_steps),
-                "results": results,
-                "timestamp": datetime.utcnow().isoformat()
+                "step": i + 1,
+                "service": service_id,
+                "tool": tool,
+                "result": step_result
             }
-            
-        except Exception as e:
-            return {"error": str(e), "status": "failed"}
+        
+        for i, step in enumerate(workflow_steps):
+            refs = {
+                value[1:] for value in step.get("parameters", {}).values()
+                if isinstance(value, str) and value.startswith("$")
+            }
+            depends_on = {
+                producer_index[ref] for ref in refs
+                if ref in producer_index and producer_index[ref] < i
+            }
+            tasks.append(asyncio.create_task(run_step(i, step, depends_on)))
+        
+        results = await self._gather_tasks(tasks)
+        
+        return {
+            "status": "completed",
+            "workflow_steps": len(workflow_steps),
+            "results": results,
+            "timestamp": _utcnow_iso()
+        }
+    
+    @staticmethod
+    async def _gather_tasks(tasks: List[asyncio.Task]) -> List[Any]:
+        """Await workflow step tasks, cancelling the rest if one fails"""
+        try:
+            return await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+    
+    async def shutdown(self):
+        """Stop the keep-alive pinger and release pooled connections"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        await self._http.aclose()
     
     async def run(self):
         """Run the MCP server"""
         from mcp.server.stdio import stdio_server
         
-        async with stdio_server() as (read_stream, write_stream):
-            await self.server.run(
-                read_stream,
-                write_stream,
-                self.server.create_initialization_options()
-            )
+        # Started here rather than in __init__, which has no running loop
+        if KEEPALIVE_INTERVAL_SECONDS > 0 and self.cfg.api_key:
+            self._keepalive_task = asyncio.create_task(self._keepalive_loop())
+        
+        try:
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self.server.create_initialization_options()
+                )
+        finally:
+            await self.shutdown()
 
 def main():
     """Main entry point"""
     orchestrator = IASOOrchestrator()
-    asyncio.run(orchestrator.run())
+    try:
+        # libuv-backed loop: cheaper socket I/O for the polling/gather workload
+        import uvloop
+    except ImportError:
+        asyncio.run(orchestrator.run())
+        return
+    
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(orchestrator.run())
+    else:
+        uvloop.install()
+        asyncio.run(orchestrator.run())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
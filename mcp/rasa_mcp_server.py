@@ -5,13 +5,23 @@ Exposes RASA conversational AI capabilities via Model Context Protocol
 """
 
 import asyncio
-import json
 import os
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
 import uuid
+from collections import OrderedDict, deque
 
 import httpx
+import orjson
+
+try:
+    import numpy as np
+except ImportError:  # Optional: only speeds up long conversations
+    np = None
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 from pydantic import BaseModel
@@ -20,6 +30,59 @@ from pydantic import BaseModel
 RASA_SERVER_URL = os.getenv("RASA_SERVER_URL", "http://localhost:5005")
 RASA_ACTION_SERVER_URL = os.getenv("RASA_ACTION_SERVER_URL", "http://localhost:5055")
 
+# Tool output is compact JSON; IASO_PRETTY_JSON=1 indents it for debugging
+_JSON_OPTIONS = orjson.OPT_INDENT_2 if os.getenv("IASO_PRETTY_JSON") == "1" else 0
+
+# RASA REST endpoints, relative to the shared client's base_url
+_WEBHOOK_PATH = "/webhooks/rest/webhook"
+_PARSE_PATH = "/model/parse"
+_TRACKER_PATH = "/conversations/{}/tracker"
+_TRACKER_EVENTS_PATH = "/conversations/{}/tracker/events"
+_EXECUTE_PATH = "/conversations/{}/execute"
+
+# Analyses toggled in quick succession reuse one tracker download
+TRACKER_CACHE_TTL_SECONDS = 2.0
+
+# Projecting more events than this runs in a worker thread
+THREAD_OFFLOAD_MIN_EVENTS = 500
+
+# Below this many intents the NumPy setup costs more than the Python loop
+NUMPY_MIN_INTENTS = 64
+LOW_CONFIDENCE_THRESHOLD = 0.7
+
+# In-process session tracking is bounded: least recently active sessions are
+# evicted past MAX_SESSIONS, and each keeps only its latest turns
+MAX_SESSIONS = int(os.getenv("RASA_MAX_SESSIONS", "10000"))
+MAX_SESSION_MESSAGES = 200
+
+# Keyword fallback when the NLU model finds no entities: one alternation
+# with a named group per entity type, so a single scan labels every match
+FALLBACK_ENTITY_TERMS = {
+    "severity": ("mild", "moderate", "severe", "acute", "chronic", "sharp", "dull"),
+    "body_part": ("chest", "abdomen", "stomach", "head", "back", "arm", "leg", "throat", "neck", "shoulder", "knee"),
+    "symptom": (
+        "shortness of breath", "headache", "pain", "cough", "fever", "nausea",
+        "vomiting", "dizziness", "fatigue", "rash", "swelling"
+    ),
+    "medication": (
+        "acetaminophen", "ibuprofen", "aspirin", "metformin", "lisinopril",
+        "atorvastatin", "amoxicillin", "insulin"
+    ),
+    "condition": ("hypertension", "diabetes", "asthma", "copd", "pneumonia", "migraine", "preeclampsia")
+}
+_FALLBACK_RE = re.compile(
+    "|".join(
+        rf"(?P<{entity_type}>\b(?:{'|'.join(map(re.escape, terms))})\b)"
+        for entity_type, terms in FALLBACK_ENTITY_TERMS.items()
+    ),
+    re.IGNORECASE
+)
+FALLBACK_ENTITY_CONFIDENCE = 0.5
+
+# NLU parses are cached by text; canned replies ("yes", "no") dominate traffic
+NLU_CACHE_MAX_ENTRIES = 20000
+NLU_CACHE_TTL_SECONDS = 3600.0
+
 class ConversationRequest(BaseModel):
     """Request model for conversation interaction"""
     message: str
@@ -32,172 +95,223 @@ class ConversationContext(BaseModel):
     conversation_type: Optional[str] = None  # symptom_check, appointment, medication, etc.
     clinical_context: Optional[Dict[str, Any]] = None
 
+# Custom actions exposed through trigger_action
+RASA_ACTIONS = (
+    "action_assess_symptoms",
+    "action_schedule_appointment",
+    "action_check_drug_interactions",
+    "action_medication_adherence_check",
+    "action_prenatal_risk_assessment",
+    "action_generate_soap_note"
+)
+
+# Opening prompt per conversation type
+INITIAL_MESSAGES = {
+    "symptom_check": "I'd like to help you with your symptoms. Can you describe what you're experiencing?",
+    "appointment": "I can help you schedule an appointment. What type of appointment do you need?",
+    "medication": "I'm here to help with your medication questions. What would you like to know?",
+    "prenatal": "Hello! I'm calling for your prenatal check-in. How are you feeling today?",
+    "general": "Hello! How can I assist you with your healthcare needs today?"
+}
+
+# MCP tool schemas are constant, so build them once
+_TOOLS: Tuple[Tool, ...] = (
+    Tool(
+        name="send_message",
+        description="Send a message to RASA and get response",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "message": {
+                    "type": "string",
+                    "description": "User message to process"
+                },
+                "sender_id": {
+                    "type": "string",
+                    "description": "Unique conversation/user ID"
+                },
+                "metadata": {
+                    "type": "object",
+                    "description": "Additional context (patient_id, phone_number, etc.)"
+                }
+            },
+            "required": ["message"]
+        }
+    ),
+    Tool(
+        name="start_conversation",
+        description="Start a new medical conversation session",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "conversation_type": {
+                    "type": "string",
+                    "enum": list(INITIAL_MESSAGES),
+                    "description": "Type of medical conversation"
+                },
+                "patient_id": {
+                    "type": "string",
+                    "description": "Patient identifier"
+                },
+                "initial_context": {
+                    "type": "object",
+                    "description": "Initial clinical context"
+                }
+            },
+            "required": ["conversation_type"]
+        }
+    ),
+    Tool(
+        name="get_conversation_state",
+        description="Get current conversation state and context",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "sender_id": {
+                    "type": "string",
+                    "description": "Conversation ID"
+                }
+            },
+            "required": ["sender_id"]
+        }
+    ),
+    Tool(
+        name="extract_medical_entities",
+        description="Extract medical entities from a conversation",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "text": {
+                    "type": "string",
+                    "description": "Text to extract entities from"
+                },
+                "entity_types": {
+                    "type": "array",
+                    "items": {
+                        "type": "string",
+                        "enum": ["symptom", "medication", "condition", "body_part", "severity"]
+                    },
+                    "description": "Types of entities to extract"
+                }
+            },
+            "required": ["text"]
+        }
+    ),
+    Tool(
+        name="trigger_action",
+        description="Trigger a specific RASA custom action",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "action": {
+                    "type": "string",
+                    "enum": list(RASA_ACTIONS),
+                    "description": "Action to trigger"
+                },
+                "sender_id": {
+                    "type": "string",
+                    "description": "Conversation ID"
+                },
+                "parameters": {
+                    "type": "object",
+                    "description": "Additional parameters for the action"
+                }
+            },
+            "required": ["action", "sender_id"]
+        }
+    ),
+    Tool(
+        name="analyze_conversation",
+        description="Analyze a completed conversation for insights",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "sender_id": {
+                    "type": "string",
+                    "description": "Conversation ID to analyze"
+                },
+                "analysis_type": {
+                    "type": "string",
+                    "enum": ["summary", "entities", "intents", "sentiment", "clinical_notes"],
+                    "default": "summary"
+                }
+            },
+            "required": ["sender_id"]
+        }
+    )
+)
+
+def _utcnow_iso() -> str:
+    """Timezone-aware UTC timestamp for tool responses"""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+@dataclass
+class EventProjection:
+    """Column view of a tracker's user and bot events, built in one pass"""
+    user_texts: List[str] = field(default_factory=list)
+    # Intent name and confidence of each user turn that has one
+    user_intents: List[str] = field(default_factory=list)
+    user_confidences: List[float] = field(default_factory=list)
+    # Entities from every user turn, in order
+    user_entities: List[Dict[str, Any]] = field(default_factory=list)
+    bot_texts: List[str] = field(default_factory=list)
+
 class RASAMCPServer:
     """MCP Server for RASA medical dialog management"""
     
     def __init__(self):
         self.server = Server("rasa-medical-dialog")
+        # Every tool talks to the same RASA server, so share one pooled
+        # client rather than opening a connection per call. HTTP/2 is
+        # negotiated over TLS (e.g. behind an h2 proxy); plain http:// RASA
+        # falls back to HTTP/1.1 keep-alive on the same pool
+        self._client = httpx.AsyncClient(
+            base_url=RASA_SERVER_URL,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=200,
+                max_keepalive_connections=50,
+                keepalive_expiry=300.0
+            ),
+            http2=True
+        )
+        self._dispatch = {
+            "send_message": self.send_message,
+            "start_conversation": self.start_conversation,
+            "get_conversation_state": self.get_conversation_state,
+            "extract_medical_entities": self.extract_medical_entities,
+            "trigger_action": self.trigger_action,
+            "analyze_conversation": self.analyze_conversation
+        }
         self.setup_tools()
-        self.sessions = {}  # Track conversation sessions
+        # Track conversation sessions, least recently active first
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # sender_id -> (event count, projection); a grown tracker is re-projected
+        self._projections: "OrderedDict[str, Tuple[Tuple[int, Optional[float]], EventProjection]]" = OrderedDict()
+        # sender_id -> (fetched_at, tracker); dropped whenever we change the conversation
+        self._tracker_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # text -> (parsed_at, raw /model/parse result)
+        self._nlu_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
     
     def setup_tools(self):
         """Register available tools"""
         
         @self.server.list_tools()
         async def list_tools() -> List[Tool]:
-            return [
-                Tool(
-                    name="send_message",
-                    description="Send a message to RASA and get response",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "message": {
-                                "type": "string",
-                                "description": "User message to process"
-                            },
-                            "sender_id": {
-                                "type": "string",
-                                "description": "Unique conversation/user ID"
-                            },
-                            "metadata": {
-                                "type": "object",
-                                "description": "Additional context (patient_id, phone_number, etc.)"
-                            }
-                        },
-                        "required": ["message"]
-                    }
-                ),
-                Tool(
-                    name="start_conversation",
-                    description="Start a new medical conversation session",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "conversation_type": {
-                                "type": "string",
-                                "enum": ["symptom_check", "appointment", "medication", "prenatal", "general"],
-                                "description": "Type of medical conversation"
-                            },
-                            "patient_id": {
-                                "type": "string",
-                                "description": "Patient identifier"
-                            },
-                            "initial_context": {
-                                "type": "object",
-                                "description": "Initial clinical context"
-                            }
-                        },
-                        "required": ["conversation_type"]
-                    }
-                ),
-                Tool(
-                    name="get_conversation_state",
-                    description="Get current conversation state and context",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "sender_id": {
-                                "type": "string",
-                                "description": "Conversation ID"
-                            }
-                        },
-                        "required": ["sender_id"]
-                    }
-                ),
-                Tool(
-                    name="extract_medical_entities",
-                    description="Extract medical entities from a conversation",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "text": {
-                                "type": "string",
-                                "description": "Text to extract entities from"
-                            },
-                            "entity_types": {
-                                "type": "array",
-                                "items": {
-                                    "type": "string",
-                                    "enum": ["symptom", "medication", "condition", "body_part", "severity"]
-                                },
-                                "description": "Types of entities to extract"
-                            }
-                        },
-                        "required": ["text"]
-                    }
-                ),
-                Tool(
-                    name="trigger_action",
-                    description="Trigger a specific RASA custom action",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "action": {
-                                "type": "string",
-                                "enum": [
-                                    "action_assess_symptoms",
-                                    "action_schedule_appointment",
-                                    "action_check_drug_interactions",
-                                    "action_medication_adherence_check",
-                                    "action_prenatal_risk_assessment",
-                                    "action_generate_soap_note"
-                                ],
-                                "description": "Action to trigger"
-                            },
-                            "sender_id": {
-                                "type": "string",
-                                "description": "Conversation ID"
-                            },
-                            "parameters": {
-                                "type": "object",
-                                "description": "Additional parameters for the action"
-                            }
-                        },
-                        "required": ["action", "sender_id"]
-                    }
-                ),
-                Tool(
-                    name="analyze_conversation",
-                    description="Analyze a completed conversation for insights",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "sender_id": {
-                                "type": "string",
-                                "description": "Conversation ID to analyze"
-                            },
-                            "analysis_type": {
-                                "type": "string",
-                                "enum": ["summary", "entities", "intents", "sentiment", "clinical_notes"],
-                                "default": "summary"
-                            }
-                        },
-                        "required": ["sender_id"]
-                    }
-                )
-            ]
+            return list(_TOOLS)
         
         @self.server.call_tool()
         async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
-            if name == "send_message":
-                result = await self.send_message(arguments)
-            elif name == "start_conversation":
-                result = await self.start_conversation(arguments)
-            elif name == "get_conversation_state":
-                result = await self.get_conversation_state(arguments)
-            elif name == "extract_medical_entities":
-                result = await self.extract_medical_entities(arguments)
-            elif name == "trigger_action":
-                result = await self.trigger_action(arguments)
-            elif name == "analyze_conversation":
-                result = await self.analyze_conversation(arguments)
+            handler = self._dispatch.get(name)
+            if handler:
+                result = await handler(arguments)
             else:
                 result = {"error": f"Unknown tool: {name}"}
             
+            # Compact output unless pretty-printing was asked for while debugging
             return [TextContent(
                 type="text",
-                text=json.dumps(result, indent=2)
+                text=orjson.dumps(result, option=_JSON_OPTIONS).decode()
             )]
     
     async def send_message(self, args: Dict[str, Any]) -> Dict[str, Any]:
@@ -207,44 +321,39 @@ class RASAMCPServer:
             sender_id = args.get("sender_id") or str(uuid.uuid4())
             metadata = args.get("metadata", {})
             
-            # Prepare RASA request
-            payload = {
-                "sender": sender_id,
-                "message": message,
-                "metadata": metadata
-            }
+            response = await self._client.post(
+                _WEBHOOK_PATH,
+                json={"sender": sender_id, "message": message, "metadata": metadata}
+            )
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{RASA_SERVER_URL}/webhooks/rest/webhook",
-                    json=payload
-                )
+            if response.status_code == 200:
+                bot_messages = orjson.loads(response.content)
+                self._tracker_cache.pop(sender_id, None)
+                now = _utcnow_iso()
                 
-                if response.status_code == 200:
-                    bot_messages = response.json()
-                    
-                    # Track session
-                    if sender_id not in self.sessions:
-                        self.sessions[sender_id] = {
-                            "started_at": datetime.utcnow().isoformat(),
-                            "messages": []
-                        }
-                    
-                    self.sessions[sender_id]["messages"].append({
-                        "user": message,
-                        "bot": bot_messages,
-                        "timestamp": datetime.utcnow().isoformat()
+                # Track session
+                if sender_id not in self.sessions:
+                    self._add_session(sender_id, {
+                        "started_at": now
                     })
-                    
-                    # Extract relevant information
-                    return {
-                        "sender_id": sender_id,
-                        "responses": bot_messages,
-                        "session_active": True,
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
                 else:
-                    return {"error": f"RASA error: {response.status_code}"}
+                    self.sessions.move_to_end(sender_id)
+                
+                self.sessions[sender_id]["messages"].append({
+                    "user": message,
+                    "bot": bot_messages,
+                    "timestamp": now
+                })
+                
+                # Extract relevant information
+                return {
+                    "sender_id": sender_id,
+                    "responses": bot_messages,
+                    "session_active": True,
+                    "timestamp": now
+                }
+            else:
+                return {"error": f"RASA error: {response.status_code}"}
                     
         except Exception as e:
             return {"error": str(e)}
@@ -260,24 +369,15 @@ class RASAMCPServer:
             sender_id = str(uuid.uuid4())
             
             # Initialize session
-            self.sessions[sender_id] = {
+            self._add_session(sender_id, {
                 "conversation_type": conversation_type,
                 "patient_id": patient_id,
-                "started_at": datetime.utcnow().isoformat(),
-                "initial_context": initial_context,
-                "messages": []
-            }
+                "started_at": _utcnow_iso(),
+                "initial_context": initial_context
+            })
             
             # Send initial message based on conversation type
-            initial_messages = {
-                "symptom_check": "I'd like to help you with your symptoms. Can you describe what you're experiencing?",
-                "appointment": "I can help you schedule an appointment. What type of appointment do you need?",
-                "medication": "I'm here to help with your medication questions. What would you like to know?",
-                "prenatal": "Hello! I'm calling for your prenatal check-in. How are you feeling today?",
-                "general": "Hello! How can I assist you with your healthcare needs today?"
-            }
-            
-            initial_message = initial_messages.get(conversation_type, initial_messages["general"])
+            initial_message = INITIAL_MESSAGES.get(conversation_type, INITIAL_MESSAGES["general"])
             
             # Send restart action to RASA to clear any previous state
             await self._restart_conversation(sender_id)
@@ -298,7 +398,7 @@ class RASAMCPServer:
                 "conversation_type": conversation_type,
                 "status": "started",
                 "initial_message": initial_message,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": _utcnow_iso()
             }
             
         except Exception as e:
@@ -310,27 +410,24 @@ class RASAMCPServer:
             sender_id = args["sender_id"]
             
             # Get tracker state from RASA
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{RASA_SERVER_URL}/conversations/{sender_id}/tracker"
-                )
+            response = await self._client.get(_TRACKER_PATH.format(sender_id))
+            
+            if response.status_code == 200:
+                tracker = orjson.loads(response.content)
                 
-                if response.status_code == 200:
-                    tracker = response.json()
-                    
-                    # Extract relevant state information
-                    return {
-                        "sender_id": sender_id,
-                        "slots": tracker.get("slots", {}),
-                        "latest_message": tracker.get("latest_message", {}),
-                        "events": len(tracker.get("events", [])),
-                        "active": tracker.get("active", False),
-                        "latest_action": tracker.get("latest_action_name"),
-                        "session_data": self.sessions.get(sender_id, {}),
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                else:
-                    return {"error": f"Failed to get tracker: {response.status_code}"}
+                # Extract relevant state information
+                return {
+                    "sender_id": sender_id,
+                    "slots": tracker.get("slots", {}),
+                    "latest_message": tracker.get("latest_message", {}),
+                    "events": len(tracker.get("events", [])),
+                    "active": tracker.get("active", False),
+                    "latest_action": tracker.get("latest_action_name"),
+                    "session_data": self._session_view(sender_id),
+                    "timestamp": _utcnow_iso()
+                }
+            else:
+                return {"error": f"Failed to get tracker: {response.status_code}"}
                     
         except Exception as e:
             return {"error": str(e)}
@@ -338,50 +435,44 @@ class RASAMCPServer:
     async def extract_medical_entities(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Extract medical entities using RASA NLU"""
         try:
-            text = args["text"]
+            # Strip once so the entity offsets line up with the echoed text
+            text = args["text"].strip()
             entity_types = args.get("entity_types", [])
             
             # Parse message through RASA NLU
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{RASA_SERVER_URL}/model/parse",
-                    json={"text": text}
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Filter entities by type if specified
-                    entities = result.get("entities", [])
-                    if entity_types:
-                        entities = [e for e in entities if e["entity"] in entity_types]
-                    
-                    # Group entities by type
-                    grouped_entities = {}
-                    for entity in entities:
-                        entity_type = entity["entity"]
-                        if entity_type not in grouped_entities:
-                            grouped_entities[entity_type] = []
-                        grouped_entities[entity_type].append({
-                            "value": entity["value"],
-                            "confidence": entity.get("confidence", 1.0),
-                            "start": entity.get("start"),
-                            "end": entity.get("end")
-                        })
-                    
-                    return {
-                        "text": text,
-                        "intent": {
-                            "name": result.get("intent", {}).get("name"),
-                            "confidence": result.get("intent", {}).get("confidence")
-                        },
-                        "entities": grouped_entities,
-                        "entity_count": len(entities),
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                else:
-                    return {"error": f"NLU parsing failed: {response.status_code}"}
-                    
+            result = await self._parse_nlu(text)
+            if "error" in result:
+                return result
+            
+            # Filter entities by type if specified
+            entities = result.get("entities") or self._fallback_entities(text)
+            if entity_types:
+                entities = [e for e in entities if e["entity"] in entity_types]
+            
+            # Group entities by type
+            grouped_entities = {}
+            for entity in entities:
+                entity_type = entity["entity"]
+                if entity_type not in grouped_entities:
+                    grouped_entities[entity_type] = []
+                grouped_entities[entity_type].append({
+                    "value": entity["value"],
+                    "confidence": entity.get("confidence", 1.0),
+                    "start": entity.get("start"),
+                    "end": entity.get("end")
+                })
+            
+            return {
+                "text": text,
+                "intent": {
+                    "name": result.get("intent", {}).get("name"),
+                    "confidence": result.get("intent", {}).get("confidence")
+                },
+                "entities": grouped_entities,
+                "entity_count": len(entities),
+                "timestamp": _utcnow_iso()
+            }
+            
         except Exception as e:
             return {"error": str(e)}
     
@@ -392,12 +483,6 @@ class RASAMCPServer:
             sender_id = args["sender_id"]
             parameters = args.get("parameters", {})
             
-            # Get current tracker state
-            tracker_response = await self._get_tracker(sender_id)
-            if "error" in tracker_response:
-                return tracker_response
-            
-            # Trigger the action
             payload = {
                 "name": action,
                 "policy": "action_trigger",
@@ -405,30 +490,36 @@ class RASAMCPServer:
                 "parameters": parameters
             }
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{RASA_SERVER_URL}/conversations/{sender_id}/execute",
-                    json=payload
-                )
+            # Snapshot the slots before the action runs; fetching this
+            # alongside the execute call could observe the action's writes
+            tracker_response = await self._get_tracker(sender_id, max_age=0.0)
+            if "error" in tracker_response:
+                return tracker_response
+            
+            response = await self._client.post(
+                _EXECUTE_PATH.format(sender_id),
+                json=payload,
+                timeout=60.0
+            )
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # Get updated tracker to see action results
-                    updated_tracker = await self._get_tracker(sender_id)
-                    
-                    return {
-                        "action": action,
-                        "status": "executed",
-                        "messages": result.get("messages", []),
-                        "slots_changed": self._compare_slots(
-                            tracker_response.get("slots", {}),
-                            updated_tracker.get("slots", {})
-                        ),
-                        "timestamp": datetime.utcnow().isoformat()
-                    }
-                else:
-                    return {"error": f"Action execution failed: {response.status_code}"}
+                # Get updated tracker to see action results
+                updated_tracker = await self._get_tracker(sender_id, max_age=0.0)
+                
+                return {
+                    "action": action,
+                    "status": "executed",
+                    "messages": result.get("messages", []),
+                    "slots_changed": self._compare_slots(
+                        tracker_response.get("slots", {}),
+                        updated_tracker.get("slots", {})
+                    ),
+                    "timestamp": _utcnow_iso()
+                }
+            else:
+                return {"error": f"Action execution failed: {response.status_code}"}
                     
         except Exception as e:
             return {"error": str(e)}
@@ -439,21 +530,24 @@ class RASAMCPServer:
             sender_id = args["sender_id"]
             analysis_type = args.get("analysis_type", "summary")
             
-            # Get conversation history
-            tracker = await self._get_tracker(sender_id)
+            # Get conversation history. Clinical notes run an action that
+            # mutates the slots, so they need the live tracker; the local
+            # analyses can share a recent one
+            max_age = 0.0 if analysis_type == "clinical_notes" else TRACKER_CACHE_TTL_SECONDS
+            tracker = await self._get_tracker(sender_id, max_age=max_age)
             if "error" in tracker:
                 return tracker
             
             events = tracker.get("events", [])
             
             if analysis_type == "summary":
-                return self._analyze_summary(events, tracker)
+                return self._analyze_summary(await self._project_events(sender_id, events), tracker)
             elif analysis_type == "entities":
-                return self._analyze_entities(events)
+                return self._analyze_entities(await self._project_events(sender_id, events))
             elif analysis_type == "intents":
-                return self._analyze_intents(events)
+                return self._analyze_intents(await self._project_events(sender_id, events))
             elif analysis_type == "sentiment":
-                return self._analyze_sentiment(events)
+                return self._analyze_sentiment(await self._project_events(sender_id, events))
             elif analysis_type == "clinical_notes":
                 return await self._generate_clinical_notes(sender_id, events, tracker)
             else:
@@ -463,127 +557,209 @@ class RASAMCPServer:
             return {"error": str(e)}
     
     # Helper methods
+    def _add_session(self, sender_id: str, session: Dict[str, Any]):
+        """Start tracking a session, evicting the least recently active past the cap"""
+        session["messages"] = deque(maxlen=MAX_SESSION_MESSAGES)
+        self.sessions[sender_id] = session
+        self.sessions.move_to_end(sender_id)
+        while len(self.sessions) > MAX_SESSIONS:
+            evicted, _ = self.sessions.popitem(last=False)
+            self._projections.pop(evicted, None)
+    
+    def _session_view(self, sender_id: str) -> Dict[str, Any]:
+        """JSON-ready copy of a tracked session"""
+        session = self.sessions.get(sender_id)
+        if session is None:
+            return {}
+        return {**session, "messages": list(session["messages"])}
+    
     async def _restart_conversation(self, sender_id: str):
         """Restart conversation for a sender"""
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{RASA_SERVER_URL}/conversations/{sender_id}/tracker/events",
-                json={"event": "restart"}
-            )
+        self._tracker_cache.pop(sender_id, None)
+        self._projections.pop(sender_id, None)
+        await self._client.post(
+            _TRACKER_EVENTS_PATH.format(sender_id),
+            json={"event": "restart"}
+        )
     
-    async def _get_tracker(self, sender_id: str) -> Dict[str, Any]:
-        """Get tracker state for a conversation"""
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{RASA_SERVER_URL}/conversations/{sender_id}/tracker"
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"error": f"Failed to get tracker: {response.status_code}"}
+    @staticmethod
+    def _fallback_entities(text: str) -> List[Dict[str, Any]]:
+        """Keyword-matched entities in RASA's format, for when NLU finds none"""
+        return [
+            {
+                "entity": match.lastgroup,
+                "value": match.group(),
+                "start": match.start(),
+                "end": match.end(),
+                "confidence": FALLBACK_ENTITY_CONFIDENCE
+            }
+            for match in _FALLBACK_RE.finditer(text)
+        ]
+    
+    async def _parse_nlu(self, text: str) -> Dict[str, Any]:
+        """Parse text with RASA NLU, reusing recent results for the same text"""
+        cached = self._nlu_cache.get(text)
+        if cached is not None:
+            parsed_at, result = cached
+            if time.monotonic() - parsed_at < NLU_CACHE_TTL_SECONDS:
+                self._nlu_cache.move_to_end(text)
+                return result
+            del self._nlu_cache[text]
+        
+        response = await self._client.post(_PARSE_PATH, json={"text": text})
+        if response.status_code != 200:
+            return {"error": f"NLU parsing failed: {response.status_code}"}
+        
+        result = orjson.loads(response.content)
+        self._nlu_cache[text] = (time.monotonic(), result)
+        if len(self._nlu_cache) > NLU_CACHE_MAX_ENTRIES:
+            self._nlu_cache.popitem(last=False)
+        return result
+    
+    async def _get_tracker(self, sender_id: str, max_age: float = TRACKER_CACHE_TTL_SECONDS) -> Dict[str, Any]:
+        """Get tracker state for a conversation, reusing one fetched within ``max_age`` seconds"""
+        cached = self._tracker_cache.get(sender_id)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        
+        response = await self._client.get(_TRACKER_PATH.format(sender_id))
+        
+        if response.status_code == 200:
+            tracker = orjson.loads(response.content)
+            self._tracker_cache[sender_id] = (time.monotonic(), tracker)
+            self._tracker_cache.move_to_end(sender_id)
+            if len(self._tracker_cache) > MAX_SESSIONS:
+                self._tracker_cache.popitem(last=False)
+            return tracker
+        else:
+            return {"error": f"Failed to get tracker: {response.status_code}"}
     
     def _compare_slots(self, old_slots: Dict, new_slots: Dict) -> Dict[str, Any]:
         """Compare slot values to find changes"""
+        # Most actions leave the slots untouched; dict equality runs in C
+        if old_slots is new_slots or old_slots == new_slots:
+            return {}
+        
         changes = {}
+        old_get = old_slots.get
         for key, new_value in new_slots.items():
-            old_value = old_slots.get(key)
-            if old_value != new_value:
-                changes[key] = {
-                    "old": old_value,
-                    "new": new_value
-                }
+            old_value = old_get(key)
+            if old_value is new_value or old_value == new_value:
+                continue
+            changes[key] = {
+                "old": old_value,
+                "new": new_value
+            }
         return changes
     
-    def _analyze_summary(self, events: List[Dict], tracker: Dict) -> Dict[str, Any]:
-        """Generate conversation summary"""
-        user_messages = []
-        bot_messages = []
-        intents = []
+    async def _project_events(self, sender_id: str, events: List[Dict]) -> EventProjection:
+        """Split tracker events into per-field columns, reusing the last projection if unchanged"""
+        # The tracker only returns events since the last restart, so a new
+        # conversation can reach the old event count; the last event's
+        # timestamp tells them apart
+        version = (len(events), events[-1].get("timestamp") if events else None)
+        cached = self._projections.get(sender_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
         
-        for event in events:
-            if event.get("event") == "user":
-                user_messages.append(event.get("text", ""))
-                if event.get("parse_data", {}).get("intent"):
-                    intents.append(event["parse_data"]["intent"]["name"])
-            elif event.get("event") == "bot":
-                bot_messages.append(event.get("text", ""))
+        if len(events) > THREAD_OFFLOAD_MIN_EVENTS:
+            # Long conversations would stall other sessions on the loop
+            projection = await asyncio.to_thread(self._build_projection, events)
+        else:
+            projection = self._build_projection(events)
         
+        # Cache bookkeeping stays on the loop thread
+        self._projections[sender_id] = (version, projection)
+        self._projections.move_to_end(sender_id)
+        if len(self._projections) > MAX_SESSIONS:
+            self._projections.popitem(last=False)
+        return projection
+    
+    @staticmethod
+    def _build_projection(events: List[Dict]) -> EventProjection:
+        """One pass over the events, filling every column"""
+        projection = EventProjection()
+        for event in events:
+            event_type = event.get("event")
+            if event_type == "user":
+                projection.user_texts.append(event.get("text", ""))
+                parse_data = event.get("parse_data") or {}
+                intent = parse_data.get("intent")
+                if intent:
+                    projection.user_intents.append(intent["name"])
+                    projection.user_confidences.append(intent.get("confidence", 0))
+                projection.user_entities.extend(parse_data.get("entities", []))
+            elif event_type == "bot":
+                projection.bot_texts.append(event.get("text", ""))
+        return projection
+    
+    def _analyze_summary(self, projection: EventProjection, tracker: Dict) -> Dict[str, Any]:
+        """Generate conversation summary"""
+        intents = projection.user_intents
         slots = tracker.get("slots", {})
         
         return {
             "conversation_summary": {
-                "total_turns": len(user_messages),
-                "user_messages": len(user_messages),
-                "bot_messages": len(bot_messages),
-                "unique_intents": list(set(intents)),
+                "total_turns": len(projection.user_texts),
+                "user_messages": len(projection.user_texts),
+                "bot_messages": len(projection.bot_texts),
+                "unique_intents": list(dict.fromkeys(intents)),
                 "slots_filled": {k: v for k, v in slots.items() if v is not None},
                 "latest_intent": intents[-1] if intents else None,
                 "conversation_complete": tracker.get("active", True) is False
             },
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": _utcnow_iso()
         }
     
-    def _analyze_entities(self, events: List[Dict]) -> Dict[str, Any]:
+    def _analyze_entities(self, projection: EventProjection) -> Dict[str, Any]:
         """Extract all entities from conversation"""
-        all_entities = {}
-        
-        for event in events:
-            if event.get("event") == "user" and event.get("parse_data"):
-                entities = event["parse_data"].get("entities", [])
-                for entity in entities:
-                    entity_type = entity["entity"]
-                    if entity_type not in all_entities:
-                        all_entities[entity_type] = []
-                    all_entities[entity_type].append(entity["value"])
-        
-        # Deduplicate
-        for entity_type in all_entities:
-            all_entities[entity_type] = list(set(all_entities[entity_type]))
+        # Values are deduplicated as they are collected, keeping
+        # first-mention order
+        seen_values: Dict[str, Dict[Any, None]] = {}
+        for entity in projection.user_entities:
+            seen_values.setdefault(entity["entity"], {})[entity["value"]] = None
+        all_entities = {entity_type: list(values) for entity_type, values in seen_values.items()}
         
         return {
             "entities_extracted": all_entities,
             "entity_types": list(all_entities.keys()),
             "total_entities": sum(len(v) for v in all_entities.values()),
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": _utcnow_iso()
         }
     
-    def _analyze_intents(self, events: List[Dict]) -> Dict[str, Any]:
+    def _analyze_intents(self, projection: EventProjection) -> Dict[str, Any]:
         """Analyze intent patterns in conversation"""
-        intent_sequence = []
-        intent_confidence = []
-        
-        for event in events:
-            if event.get("event") == "user" and event.get("parse_data"):
-                intent = event["parse_data"].get("intent", {})
-                if intent:
-                    intent_sequence.append(intent["name"])
-                    intent_confidence.append(intent.get("confidence", 0))
+        intent_sequence = projection.user_intents
+        intent_confidence = projection.user_confidences
         
-        avg_confidence = sum(intent_confidence) / len(intent_confidence) if intent_confidence else 0
+        if np is not None and len(intent_confidence) > NUMPY_MIN_INTENTS:
+            # float64 so thresholds compare exactly as the Python path does
+            conf = np.fromiter(intent_confidence, dtype=np.float64, count=len(intent_confidence))
+            avg_confidence = float(conf.mean())
+            low_confidence_count = int((conf < LOW_CONFIDENCE_THRESHOLD).sum())
+        else:
+            avg_confidence = sum(intent_confidence) / len(intent_confidence) if intent_confidence else 0
+            low_confidence_count = sum(1 for c in intent_confidence if c < LOW_CONFIDENCE_THRESHOLD)
         
         return {
             "intent_analysis": {
                 "sequence": intent_sequence,
-                "unique_intents": list(set(intent_sequence)),
+                "unique_intents": list(dict.fromkeys(intent_sequence)),
                 "average_confidence": round(avg_confidence, 3),
-                "low_confidence_count": sum(1 for c in intent_confidence if c < 0.7),
+                "low_confidence_count": low_confidence_count,
                 "intent_transitions": self._get_intent_transitions(intent_sequence)
             },
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": _utcnow_iso()
         }
     
     def _get_intent_transitions(self, intents: List[str]) -> List[Dict[str, str]]:
         """Get intent transition patterns"""
-        transitions = []
-        for i in range(len(intents) - 1):
-            transitions.append({
-                "from": intents[i],
-                "to": intents[i + 1]
-            })
-        return transitions
+        return [
+            {"from": prev_intent, "to": next_intent}
+            for prev_intent, next_intent in zip(intents, intents[1:])
+        ]
     
-    def _analyze_sentiment(self, events: List[Dict]) -> Dict[str, Any]:
+    def _analyze_sentiment(self, projection: EventProjection) -> Dict[str, Any]:
         """Basic sentiment analysis (would integrate with sentiment service)"""
         # This is a placeholder - in production, integrate with a sentiment analysis service
         return {
@@ -593,7 +769,7 @@ class RASAMCPServer:
                 "negative_segments": [],
                 "requires_escalation": False
             },
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": _utcnow_iso()
         }
     
     async def _generate_clinical_notes(self, sender_id: str, events: List[Dict], tracker: Dict) -> Dict[str, Any]:
@@ -612,7 +788,7 @@ class RASAMCPServer:
                     "notes": result.get("messages", []),
                     "slots": tracker.get("slots", {})
                 },
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": _utcnow_iso()
             }
         except Exception as e:
             return {"error": f"Failed to generate clinical notes: {str(e)}"}
@@ -621,17 +797,31 @@ class RASAMCPServer:
         """Run the MCP server"""
         from mcp.server.stdio import stdio_server
         
-        async with stdio_server() as (read_stream, write_stream):
-            await self.server.run(
-                read_stream,
-                write_stream,
-                self.server.create_initialization_options()
-            )
+        # Closing the client on exit releases its pooled connections
+        async with self._client:
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self.server.create_initialization_options()
+                )
 
 def main():
     """Main entry point"""
     server = RASAMCPServer()
-    asyncio.run(server.run())
+    try:
+        # libuv-backed loop: cheaper socket I/O for the RASA round trips
+        import uvloop
+    except ImportError:
+        asyncio.run(server.run())
+        return
+    
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(server.run())
+    else:
+        uvloop.install()
+        asyncio.run(server.run())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""Helpers shared across the IASO MCP servers"""
+
+from .http_client import (
+    RUNPOD_API_BASE,
+    close_http_client,
+    get_http_client,
+    post_with_retry,
+    request_with_retry
+)
+
+__all__ = ["RUNPOD_API_BASE", "close_http_client", "get_http_client", "post_with_retry", "request_with_retry"]
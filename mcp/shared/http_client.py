@@ -0,0 +1,93 @@
+"""
+Process-wide httpx client shared by the MCP tool servers that call RunPod
+"""
+
+import asyncio
+from typing import Any, Iterable, Optional
+
+import httpx
+
+RUNPOD_API_BASE = "https://api.runpod.ai/v2"
+
+# Transient gateway errors from RunPod cold starts are retried after these
+# delays; connect failures are retried by the transport itself
+RETRYABLE_STATUS_CODES = frozenset({502, 503, 504})
+RETRY_DELAYS = (0.1, 0.4)
+CONNECT_RETRIES = 2
+
+# Methods that are safe to resend after the connection drops mid-request.
+# Anything else (POST /run, /runsync) may already have started a billed job,
+# so it is only retried when the request provably never left the client
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client(timeout: float = 30.0) -> httpx.AsyncClient:
+    """
+    Return the shared RunPod client, creating it on first use.
+
+    `timeout` only applies when the client is created; callers that need a
+    different budget pass `timeout=` on the request itself. Auth is passed
+    per request as well, since each tool may carry its own API key.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # An explicit transport ignores the client's http2/limits arguments,
+        # so they are set on the transport
+        _http_client = httpx.AsyncClient(
+            base_url=RUNPOD_API_BASE,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=CONNECT_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=100,
+                    keepalive_expiry=300.0
+                )
+            )
+        )
+    return _http_client
+
+async def request_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    *,
+    delays: Iterable[float] = RETRY_DELAYS,
+    **kwargs: Any
+) -> httpx.Response:
+    """
+    Send a request and read the full body, retrying 502/503/504 and
+    transport failures after each of `delays`.
+
+    Idempotent methods retry any transport error; other methods only retry
+    errors raised before the request was sent, so a dropped connection
+    never submits the same job twice. Returns the last response once it is
+    not retryable or the retries are spent; an error on the final attempt
+    is raised to the caller.
+    """
+    retryable_errors = httpx.TransportError if method in IDEMPOTENT_METHODS else UNSENT_REQUEST_ERRORS
+    for delay in (*delays, None):
+        try:
+            async with client.stream(method, url, **kwargs) as response:
+                await response.aread()
+        except retryable_errors:
+            if delay is None:
+                raise
+        else:
+            if delay is None or response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+        await asyncio.sleep(delay)
+
+async def post_with_retry(client: httpx.AsyncClient, url: str, **kwargs: Any) -> httpx.Response:
+    """POST via request_with_retry; only unsent requests are retried on transport errors"""
+    return await request_with_retry(client, "POST", url, **kwargs)
+
+async def close_http_client() -> None:
+    """Close the shared client; call once at process shutdown"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the shared RunPod retry helper
+Connections are simulated with httpx.MockTransport; run with: pytest mcp/test_http_client.py
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from shared.http_client import request_with_retry
+
+NO_DELAYS = (0.0, 0.0)
+
+class Transport:
+    """Raises or answers with each queued outcome in turn, counting attempts"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.attempts = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.attempts += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, type) and issubclass(outcome, Exception):
+            raise outcome("simulated", request=request)
+        return httpx.Response(outcome, json={"id": "job-1"})
+
+def send(transport: Transport, method: str) -> httpx.Response:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(transport)) as client:
+            return await request_with_retry(client, method, "https://api.runpod.ai/v2/ep/run", delays=NO_DELAYS)
+    return asyncio.run(run())
+
+def test_post_is_not_resent_after_the_connection_drops():
+    transport = Transport(httpx.ReadError)
+
+    with pytest.raises(httpx.ReadError):
+        send(transport, "POST")
+    assert transport.attempts == 1
+
+def test_get_is_retried_after_the_connection_drops():
+    transport = Transport(httpx.ReadError, httpx.RemoteProtocolError, 200)
+
+    assert send(transport, "GET").status_code == 200
+    assert transport.attempts == 3
+
+@pytest.mark.parametrize("error", [httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout])
+def test_post_is_retried_when_the_request_was_never_sent(error):
+    transport = Transport(error, 200)
+
+    assert send(transport, "POST").status_code == 200
+    assert transport.attempts == 2
+
+def test_last_error_is_raised_once_retries_are_spent():
+    transport = Transport(httpx.ConnectError)
+
+    with pytest.raises(httpx.ConnectError):
+        send(transport, "POST")
+    assert transport.attempts == 3
+
+@pytest.mark.parametrize("method", ["GET", "POST"])
+def test_gateway_errors_are_retried(method):
+    transport = Transport(503, 502, 200)
+
+    response = send(transport, method)
+    assert response.status_code == 200
+    assert response.json() == {"id": "job-1"}
+    assert transport.attempts == 3
+
+def test_last_gateway_error_is_returned_once_retries_are_spent():
+    transport = Transport(504)
+
+    assert send(transport, "GET").status_code == 504
+    assert transport.attempts == 3
+
+def test_other_errors_are_returned_without_retry():
+    transport = Transport(400)
+
+    assert send(transport, "POST").status_code == 400
+    assert transport.attempts == 1
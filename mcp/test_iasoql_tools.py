@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Unit tests for IASOQL template matching and SQL validation
+RunPod is replaced by httpx.MockTransport; run with: pytest mcp/test_iasoql_tools.py
+"""
+
+import asyncio
+import re
+
+import httpx
+import orjson
+import pytest
+
+from shared.http_client import RUNPOD_API_BASE
+from tools.iasoql_tools import MAX_TEMPLATE_QUERY_CHARS, IasoQLTools
+
+def make_tools(handler=None) -> IasoQLTools:
+    tools = IasoQLTools("test-key", "test-endpoint")
+    if handler is not None:
+        tools._client = httpx.AsyncClient(base_url=RUNPOD_API_BASE, transport=httpx.MockTransport(handler))
+    return tools
+
+def no_http(request: httpx.Request) -> httpx.Response:
+    raise AssertionError(f"Unexpected RunPod call: {request.url}")
+
+def generate(query: str, tenant_id: str = "tenant_a"):
+    return asyncio.run(make_tools(no_http).generate_sql_with_template(query, tenant_id=tenant_id))
+
+# Template matching and parameter extraction
+
+@pytest.mark.parametrize("query, template_name, params", [
+    ("How many patients have Diabetes",
+     "count_patients_by_condition", {"condition": "diabetes"}),
+    ("count patients with hypertension today",
+     "count_patients_by_condition", {"condition": "hypertension"}),
+    ("Show recent lab results for patient ABC123",
+     "recent_lab_results", {"patient_id": "ABC123"}),
+    ("current medications for patient p_42",
+     "active_medications", {"patient_id": "p_42"}),
+    ("latest vital signs for patient 9001",
+     "recent_vitals", {"patient_id": "9001"}),
+    ("  List upcoming appointments  ",
+     "upcoming_appointments", {}),
+])
+def test_template_params(query, template_name, params):
+    result = generate(query)
+
+    assert result["source"] == "template"
+    assert result["template_name"] == template_name
+    assert result["params"] == {"tenant_id": "tenant_a", **params}
+
+def test_template_sql_declares_every_bound_param():
+    result = generate("recent lab results for patient ABC123")
+
+    placeholders = set(re.findall(r"\{(\w+):String\}", result["sql"]))
+    assert placeholders == set(result["params"])
+    # Values are bound, never spliced into the SQL text
+    assert "ABC123" not in result["sql"]
+
+def test_condition_underscore_is_escaped_for_like():
+    result = generate("how many patients have type_2")
+
+    assert result["params"]["condition"] == "type\\_2"
+
+def test_earliest_matching_template_wins():
+    result = generate("upcoming appointments and how many patients have asthma")
+
+    assert result["template_name"] == "upcoming_appointments"
+
+class CompletedSQL:
+    """Answers every /runsync call with generated SQL, recording the requests"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return httpx.Response(200, json={
+            "status": "COMPLETED",
+            "output": {"sql": "SELECT count() FROM nexuscare_analytics.fhir_current", "metadata": {}}
+        })
+
+def test_long_query_skips_templates_for_the_llm():
+    runpod = CompletedSQL()
+    query = "how many patients have asthma given this history: " + "x" * MAX_TEMPLATE_QUERY_CHARS
+
+    result = asyncio.run(make_tools(runpod).generate_sql_with_template(query))
+
+    assert result["source"] == "llm"
+    assert len(runpod.requests) == 1
+
+def test_llm_fallback_returns_empty_params():
+    runpod = CompletedSQL()
+    result = asyncio.run(make_tools(runpod).generate_sql_with_template(
+        "average HbA1c by clinic",
+        context={"rag_context": "HbA1c is LOINC 4548-4"}
+    ))
+
+    assert result["source"] == "llm"
+    assert result["params"] == {}
+    [request] = runpod.requests
+    assert request.url.path == "/v2/test-endpoint/runsync"
+    body = orjson.loads(request.content)["input"]
+    assert body["query"] == "average HbA1c by clinic"
+    assert body["rag_context"] == "HbA1c is LOINC 4548-4"
+    assert "schema_context" in body and body["examples"]
+
+# SQL validation
+
+@pytest.mark.parametrize("sql", [
+    "SELECT count() FROM fhir_current",
+    "  with t AS (SELECT 1) SELECT * FROM t",
+    "SELECT 1;",
+    "SELECT 'DROP TABLE x; -- not really' AS note",
+    "SELECT 'it''s' AS escaped_quote",
+    "SELECT updated_at, created_at FROM fhir_current",
+])
+def test_validator_accepts_read_only_sql(sql):
+    assert make_tools().validate_healthcare_sql(sql) == {"valid": True, "issues": []}
+
+@pytest.mark.parametrize("sql, issue", [
+    ("DROP TABLE fhir_current", "Query must start with SELECT or WITH"),
+    ("SELECT 1; DROP TABLE fhir_current", "Multiple statements are not allowed"),
+    ("SELECT 1; DROP TABLE fhir_current", "Forbidden statement: DROP"),
+    ("SELECT * FROM t WHERE 1 = 1 -- AND tenant_id = 'x'", "SQL comments are not allowed"),
+    ("SELECT /* hint */ 1", "SQL comments are not allowed"),
+    ("WITH t AS (SELECT 1) insert INTO x SELECT * FROM t", "Forbidden statement: INSERT"),
+    ("SELECT 1 FROM t WHERE 'a' = 'a' OR 1 = 1; SYSTEM SHUTDOWN", "Forbidden statement: SYSTEM"),
+])
+def test_validator_rejects_unsafe_sql(sql, issue):
+    result = make_tools().validate_healthcare_sql(sql)
+
+    assert result["valid"] is False
+    assert issue in result["issues"]
+
+def test_validator_reports_each_issue_once():
+    result = make_tools().validate_healthcare_sql("SELECT 1; DELETE FROM a; DELETE FROM b")
+
+    assert result["issues"] == ["Multiple statements are not allowed", "Forbidden statement: DELETE"]
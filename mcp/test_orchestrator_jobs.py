@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the orchestrator's RunPod job submission and polling
+RunPod is replaced by httpx.MockTransport; run with: pytest mcp/test_orchestrator_jobs.py
+"""
+
+import asyncio
+
+import httpx
+
+import iaso_orchestrator
+from iaso_orchestrator import Config, IASOOrchestrator
+
+class FakeRunPod:
+    """Accepts /run, reports every /status poll as `status` and records /cancel"""
+
+    def __init__(self, status: str):
+        self.status = status
+        self.paths = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.paths.append((request.method, request.url.path))
+        if request.url.path.endswith("/run"):
+            return httpx.Response(200, json={"id": "job-1", "status": "IN_QUEUE"})
+        if "/status/" in request.url.path:
+            body = {"id": "job-1", "status": self.status}
+            if self.status == "COMPLETED":
+                body["output"] = {"insights": "Assessment: stable", "processing_time": 1.5}
+            return httpx.Response(200, json=body)
+        if "/cancel/" in request.url.path:
+            return httpx.Response(200, json={"id": "job-1", "status": "CANCELLED"})
+        return httpx.Response(404)
+
+def make_orchestrator(runpod) -> IASOOrchestrator:
+    orchestrator = IASOOrchestrator()
+    orchestrator.cfg = Config(api_key="test-key", endpoints={"whisper": "whisper-ep", "phi4": "phi4-ep"})
+    orchestrator._http = httpx.AsyncClient(transport=httpx.MockTransport(runpod))
+    return orchestrator
+
+def call_phi4(orchestrator: IASOOrchestrator):
+    return asyncio.run(orchestrator.call_service("phi4", "extract_medical_insights", {"text": "BP 120/80"}))
+
+def test_completed_job_is_polled_until_done(monkeypatch):
+    monkeypatch.setattr(iaso_orchestrator, "JOB_POLL_INITIAL_DELAY", 0.001)
+    runpod = FakeRunPod("COMPLETED")
+
+    result = call_phi4(make_orchestrator(runpod))
+
+    assert result == {"result": "Assessment: stable", "processing_time": 1.5}
+    assert runpod.paths == [("POST", "/v2/phi4-ep/run"), ("GET", "/v2/phi4-ep/status/job-1")]
+
+def test_stuck_job_is_cancelled_after_the_deadline(monkeypatch):
+    monkeypatch.setattr(iaso_orchestrator, "JOB_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(iaso_orchestrator, "JOB_POLL_MAX_DELAY", 0.005)
+    monkeypatch.setattr(iaso_orchestrator, "JOB_TIMEOUT_SECONDS", 0.05)
+    runpod = FakeRunPod("IN_QUEUE")
+    orchestrator = make_orchestrator(runpod)
+
+    result = call_phi4(orchestrator)
+
+    assert "error" in result and "TimeoutError" in result["error"]
+    assert runpod.paths[-1] == ("POST", "/v2/phi4-ep/cancel/job-1")
+    assert sum(method == "POST" for method, _ in runpod.paths) == 2
+    # The concurrency slot is released and the failure is not cached
+    assert not orchestrator._sem.locked()
+    assert not orchestrator._call_cache
+
+# Combined Phi-4 prompt (multi_task)
+
+class CompletedPhi4:
+    """Completes every job at once with a fixed Phi-4 output, counting submissions"""
+
+    def __init__(self, insights: str):
+        self.insights = insights
+        self.submissions = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.submissions += 1
+        return httpx.Response(200, json={
+            "id": "job-1",
+            "status": "COMPLETED",
+            "output": {"insights": self.insights, "processing_time": 2.0}
+        })
+
+def analyze(orchestrator: IASOOrchestrator, calls: int = 1):
+    args = {"encounter_data": {"clinical_notes": "BP 150/95"}, "analysis_goals": ["summary"]}
+
+    async def run():
+        return [await orchestrator.analyze_patient_encounter(args) for _ in range(calls)]
+    return asyncio.run(run())
+
+def test_multi_task_splits_sections():
+    runpod = CompletedPhi4("<insights>\nHypertension\n</insights>\n<summary>\nStage 2 HTN\n</summary>")
+    orchestrator = make_orchestrator(runpod)
+
+    [result] = analyze(orchestrator)
+
+    assert result["results"] == {
+        "medical_insights": {"result": "Hypertension", "processing_time": 2.0},
+        "clinical_summary": {"result": "Stage 2 HTN", "processing_time": 2.0}
+    }
+
+def test_missing_section_is_an_error_and_not_cached():
+    runpod = CompletedPhi4("<insights>\nHypertension\n</insights>")
+    orchestrator = make_orchestrator(runpod)
+
+    first, second = analyze(orchestrator, calls=2)
+
+    assert first["results"]["medical_insights"]["result"] == "Hypertension"
+    assert "Missing <summary> section" in first["results"]["clinical_summary"]["error"]
+    assert runpod.submissions == 2
+    assert not orchestrator._call_cache
+
+def test_multi_task_only_reports_requested_tasks():
+    runpod = CompletedPhi4("<insights>\nHypertension\n</insights>")
+    orchestrator = make_orchestrator(runpod)
+
+    result = asyncio.run(orchestrator.call_service("phi4", "multi_task", {"text": "BP", "tasks": ["insights"]}))
+
+    assert result == {"medical_insights": {"result": "Hypertension", "processing_time": 2.0}}
+
+def test_unknown_multi_task_is_rejected_without_a_job():
+    runpod = CompletedPhi4("")
+    orchestrator = make_orchestrator(runpod)
+
+    result = asyncio.run(orchestrator.call_service("phi4", "multi_task", {"text": "BP", "tasks": ["billing"]}))
+
+    assert "error" in result and "billing" in result["error"]
+    assert runpod.submissions == 0
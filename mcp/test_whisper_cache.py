@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Whisper MCP server's result cache
+RunPod is replaced by httpx.MockTransport; run with: pytest mcp/test_whisper_cache.py
+"""
+
+import asyncio
+
+import httpx
+
+import whisper_mcp_server
+from shared.http_client import RUNPOD_API_BASE
+from whisper_mcp_server import WhisperMCPServer
+
+AUDIO_URL = "https://example.com/dictation.wav"
+
+class FakeRunPod:
+    """Counts /runsync calls and answers with queued status codes (200 by default)"""
+
+    def __init__(self, *status_codes: int):
+        self.calls = []
+        self.status_codes = list(status_codes)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append(request)
+        status = self.status_codes.pop(0) if self.status_codes else 200
+        if status != 200:
+            return httpx.Response(status, text="worker error")
+        return httpx.Response(200, json={
+            "status": "COMPLETED",
+            "output": {
+                "transcription": f"transcript {len(self.calls)}",
+                "language": "en",
+                "segments": [{"start": 0.0, "end": 1.0, "text": "hello"}]
+            }
+        })
+
+def make_server(runpod: FakeRunPod) -> WhisperMCPServer:
+    server = WhisperMCPServer()
+    server._client = httpx.AsyncClient(base_url=RUNPOD_API_BASE, transport=httpx.MockTransport(runpod))
+    return server
+
+def transcribe(server: WhisperMCPServer, *calls):
+    async def run():
+        return [await server.transcribe_audio(args) for args in calls]
+    return asyncio.run(run())
+
+def test_identical_calls_hit_runpod_once():
+    runpod = FakeRunPod()
+    first, second = transcribe(make_server(runpod), {"audio_url": AUDIO_URL}, {"audio_url": AUDIO_URL})
+
+    assert len(runpod.calls) == 1
+    assert first["transcription"] == second["transcription"] == "transcript 1"
+
+def test_cache_key_covers_every_request_option():
+    runpod = FakeRunPod()
+    transcribe(
+        make_server(runpod),
+        {"audio_url": AUDIO_URL},
+        {"audio_url": AUDIO_URL, "language": "es"},
+        {"audio_url": AUDIO_URL, "return_segments": True},
+        {"audio_url": AUDIO_URL, "vad_filter": False}
+    )
+
+    assert len(runpod.calls) == 4
+
+def test_failures_are_not_cached():
+    runpod = FakeRunPod(500)
+    failed, retried = transcribe(make_server(runpod), {"audio_url": AUDIO_URL}, {"audio_url": AUDIO_URL})
+
+    assert "error" in failed
+    assert retried["transcription"] == "transcript 2"
+    assert len(runpod.calls) == 2
+
+def test_expired_entries_are_refetched(monkeypatch):
+    monkeypatch.setattr(whisper_mcp_server, "RESULT_CACHE_TTL_SECONDS", 0.0)
+    runpod = FakeRunPod()
+    transcribe(make_server(runpod), {"audio_url": AUDIO_URL}, {"audio_url": AUDIO_URL})
+
+    assert len(runpod.calls) == 2
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    monkeypatch.setattr(whisper_mcp_server, "RESULT_CACHE_MAX_ENTRIES", 2)
+    runpod = FakeRunPod()
+    transcribe(
+        make_server(runpod),
+        {"audio_url": "a.wav"},
+        {"audio_url": "b.wav"},
+        {"audio_url": "a.wav"},  # refreshes a.wav
+        {"audio_url": "c.wav"},  # evicts b.wav
+        {"audio_url": "a.wav"},
+        {"audio_url": "b.wav"}
+    )
+
+    assert [request.content.count(b"b.wav") for request in runpod.calls] == [0, 1, 0, 1]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the orchestrator's workflow planner
+No services are called; run with: pytest mcp/test_workflow_planner.py
+"""
+
+import pytest
+
+from iaso_orchestrator import ServiceRegistry, WorkflowPlanner
+
+def make_planner() -> WorkflowPlanner:
+    return WorkflowPlanner(ServiceRegistry())
+
+def step_outputs(steps):
+    return [step["outputs"][0] for step in steps]
+
+def test_transcription_runs_before_soap_note():
+    steps = make_planner().plan_workflow({"audio_url": "a.wav"}, ["transcription", "soap_note"])
+
+    assert step_outputs(steps) == ["transcription", "soap_note"]
+    assert [step["service"] for step in steps] == ["whisper", "phi4"]
+    assert steps[0]["depends_on"] == []
+    assert steps[1]["depends_on"] == [0]
+
+def test_prerequisites_are_planned_even_when_not_requested():
+    steps = make_planner().plan_workflow({"audio_url": "a.wav"}, ["soap_note"])
+
+    assert step_outputs(steps) == ["transcription", "soap_note"]
+
+def test_request_order_does_not_break_dependency_order():
+    steps = make_planner().plan_workflow({"audio_url": "a.wav"}, ["soap_note", "transcription"])
+
+    assert step_outputs(steps) == ["transcription", "soap_note"]
+    assert steps[1]["depends_on"] == [0]
+
+def test_shared_prerequisite_is_planned_once():
+    steps = make_planner().plan_workflow(
+        {"audio_url": "a.wav"},
+        ["soap_note", "clinical_summary", "medical_insights"]
+    )
+
+    assert step_outputs(steps) == ["transcription", "soap_note", "clinical_summary", "medical_insights"]
+    # Every analysis only waits on the transcription, so they can run together
+    assert [step["depends_on"] for step in steps[1:]] == [[0], [0], [0]]
+
+def test_available_inputs_skip_their_producers():
+    steps = make_planner().plan_workflow({"transcription": "Patient reports..."}, ["soap_note"])
+
+    assert step_outputs(steps) == ["soap_note"]
+    assert steps[0]["depends_on"] == []
+
+def test_secondary_outputs_resolve_to_their_producer():
+    steps = make_planner().plan_workflow({"audio_url": "a.wav"}, ["diagnoses", "medications"])
+
+    assert step_outputs(steps) == ["transcription", "medical_insights"]
+
+def test_unknown_output_is_rejected():
+    with pytest.raises(ValueError, match="Cannot produce required output: billing_codes"):
+        make_planner().plan_workflow({"audio_url": "a.wav"}, ["billing_codes"])
+
+def test_missing_root_input_is_rejected():
+    with pytest.raises(ValueError, match="audio_url"):
+        make_planner().plan_workflow({}, ["soap_note"])
+
+def test_resolve_is_memoized_per_input_set():
+    planner = make_planner()
+    have = frozenset({"audio_url"})
+
+    first = planner._resolve("soap_note", have)
+    assert first == ("transcription", "soap_note")
+    assert planner._resolve("soap_note", have) is first
+    assert planner._resolve("soap_note", frozenset({"transcription"})) == ("soap_note",)
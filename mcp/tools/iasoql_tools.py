@@ -2,233 +2,64 @@
 IASOQL MCP Tools - Hybrid SQL Generation with Templates and LLM
 """
 
-from typing import Dict, Any, List, Optional
-import httpx
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, Callable, List, Optional, Tuple
 import json
 import logging
+import orjson
 from datetime import datetime
 import re
 
+from shared.http_client import close_http_client, get_http_client, post_with_retry
+
 logger = logging.getLogger(__name__)
 
-class IasoQLTools:
-    """
-    Hybrid SQL generation combining templates and IASOQL LLM
-    """
-    
-    def __init__(self, runpod_api_key: str, iasoql_endpoint_id: str):
-        self.api_key = runpod_api_key
-        self.endpoint_id = iasoql_endpoint_id
-        self.base_url = f"https://api.runpod.ai/v2/{iasoql_endpoint_id}"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Common query templates
-        self.templates = {
-            # Patient queries
-            "count_patients_by_condition": {
-                "pattern": r"(count|how many) patients? (have|with) (\w+)",
-                "sql": """
-                    SELECT COUNT(DISTINCT JSONExtractString(resource, '$.subject.reference')) as patient_count
-                    FROM nexuscare_analytics.fhir_current
-                    WHERE tenant_id = '{tenant_id}'
-                    AND sign = 1
-                    AND resource_type = 'Condition'
-                    AND JSONExtractString(resource, '$.code.coding[0].display') ILIKE '%{condition}%'
-                """
-            },
-            
-            # Lab result queries
-            "recent_lab_results": {
-                "pattern": r"(recent|latest) lab (results?|tests?) for patient (\w+)",
-                "sql": """
-                    SELECT 
-                        JSONExtractString(resource, '$.code.display') as test_name,
-                        JSONExtractFloat(resource, '$.valueQuantity.value') as value,
-                        JSONExtractString(resource, '$.valueQuantity.unit') as unit,
-                        JSONExtractString(resource, '$.effectiveDateTime') as test_date,
-                        JSONExtractString(resource, '$.interpretation[0].text') as interpretation
-                    FROM nexuscare_analytics.fhir_current
-                    WHERE tenant_id = '{tenant_id}'
-                    AND sign = 1
-                    AND resource_type = 'Observation'
-                    AND JSONExtractString(resource, '$.subject.reference') = 'Patient/{patient_id}'
-                    ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.effectiveDateTime')) DESC
-                    LIMIT 20
-                """
-            },
-            
-            # Medication queries
-            "active_medications": {
-                "pattern": r"(active|current) medications? for patient (\w+)",
-                "sql": """
-                    SELECT 
-                        JSONExtractString(resource, '$.medicationCodeableConcept.coding[0].display') as medication,
-                        JSONExtractString(resource, '$.dosageInstruction[0].text') as dosage,
-                        JSONExtractString(resource, '$.authoredOn') as prescribed_date,
-                        JSONExtractString(resource, '$.status') as status
-                    FROM nexuscare_analytics.fhir_current
-                    WHERE tenant_id = '{tenant_id}'
-                    AND sign = 1
-                    AND resource_type = 'MedicationRequest'
-                    AND JSONExtractString(resource, '$.subject.reference') = 'Patient/{patient_id}'
-                    AND JSONExtractString(resource, '$.status') = 'active'
-                    ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.authoredOn')) DESC
-                """
-            },
-            
-            # Appointment queries
-            "upcoming_appointments": {
-                "pattern": r"(upcoming|next|future) appointments?",
-                "sql": """
-                    SELECT 
-                        JSONExtractString(resource, '$.description') as description,
-                        JSONExtractString(resource, '$.start') as appointment_time,
-                        JSONExtractString(resource, '$.participant[0].actor.display') as provider,
-                        JSONExtractString(resource, '$.status') as status
-                    FROM nexuscare_analytics.fhir_current
-                    WHERE tenant_id = '{tenant_id}'
-                    AND sign = 1
-                    AND resource_type = 'Appointment'
-                    AND parseDateTimeBestEffort(JSONExtractString(resource, '$.start')) > now()
-                    ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.start')) ASC
-                    LIMIT 10
-                """
-            },
-            
-            # Vital signs
-            "recent_vitals": {
-                "pattern": r"(recent|latest) vital signs? for patient (\w+)",
-                "sql": """
-                    SELECT 
-                        JSONExtractString(resource, '$.code.coding[0].display') as vital_type,
-                        JSONExtractFloat(resource, '$.valueQuantity.value') as value,
-                        JSONExtractString(resource, '$.valueQuantity.unit') as unit,
-                        JSONExtractString(resource, '$.effectiveDateTime') as recorded_date
-                    FROM nexuscare_analytics.fhir_current
-                    WHERE tenant_id = '{tenant_id}'
-                    AND sign = 1
-                    AND resource_type = 'Observation'
-                    AND JSONExtractString(resource, '$.subject.reference') = 'Patient/{patient_id}'
-                    AND JSONExtractString(resource, '$.category[0].coding[0].code') = 'vital-signs'
-                    ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.effectiveDateTime')) DESC
-                    LIMIT 10
-                """
-            }
-        }
-    
-    def find_template_match(self, query: str) -> Optional[Dict[str, Any]]:
-        """Find matching template for the query"""
-        query_lower = query.lower().strip()
-        
-        for template_name, template_data in self.templates.items():
-            pattern = template_data["pattern"]
-            match = re.search(pattern, query_lower)
-            if match:
-                return {
-                    "template_name": template_name,
-                    "template": template_data,
-                    "match_groups": match.groups()
-                }
-        
-        return None
-    
-    async def generate_sql_with_template(
-        self, 
-        query: str, 
-        tenant_id: str = "demo_tenant",
-        context: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
-        """Try template first, fall back to LLM if needed"""
-        
-        # Try to match a template
-        template_match = self.find_template_match(query)
-        
-        if template_match:
-            logger.info(f"Found template match: {template_match['template_name']}")
-            
-            # Extract parameters from query
-            sql_template = template_match["template"]["sql"]
-            match_groups = template_match["match_groups"]
-            
-            # Build parameters
-            params = {"tenant_id": tenant_id}
-            
-            # Template-specific parameter extraction
-            if "patient" in query.lower():
-                # Extract patient ID
-                patient_match = re.search(r'patient[:\s]+(\w+)', query.lower())
-                if patient_match:
-                    params["patient_id"] = patient_match.group(1)
-            
-            if "condition" in template_match["template_name"]:
-                # Extract condition name
-                if len(match_groups) >= 3:
-                    params["condition"] = match_groups[2]
-            
-            # Format SQL with parameters
-            try:
-                sql = sql_template.format(**params)
-                return {
-                    "sql": sql,
-                    "source": "template",
-                    "template_name": template_match["template_name"],
-                    "confidence": "high"
-                }
-            except KeyError as e:
-                logger.warning(f"Template parameter missing: {e}")
-                # Fall through to LLM
-        
-        # No template match or template failed - use IASOQL LLM
-        return await self.generate_sql_with_llm(query, context)
-    
-    async def generate_sql_with_llm(
-        self, 
-        query: str,
-        context: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
-        """Generate SQL using IASOQL LLM on RunPod"""
-        
-        # Prepare request
-        payload = {
-            "input": {
-                "query": query,
-                "schema_context": self._get_schema_context(),
-                "rag_context": context.get("rag_context", "") if context else "",
-                "examples": self._get_few_shot_examples()
-            }
-        }
-        
-        # Call RunPod endpoint
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/runsync",
-                headers=self.headers,
-                json=payload,
-                timeout=30.0
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"RunPod API error: {response.text}")
-            
-            result = response.json()
-            
-            if result.get("status") == "COMPLETED":
-                output = result.get("output", {})
-                return {
-                    "sql": output.get("sql"),
-                    "source": "llm",
-                    "confidence": "medium",
-                    "metadata": output.get("metadata", {})
-                }
-            else:
-                raise Exception(f"IASOQL generation failed: {result}")
-    
-    def _get_schema_context(self) -> str:
-        """Get ClickHouse schema context"""
-        return """
+# Templates are short phrases, so longer queries (e.g. with pasted clinical
+# context) skip template matching and go straight to the LLM
+MAX_TEMPLATE_QUERY_CHARS = 512
+
+# Named groups are global to a pattern, so strip them when fusing templates
+# into one alternation; each template's own pattern keeps them for extraction
+_NAMED_GROUP_RE = re.compile(r'\(\?P<\w+>')
+
+# One left-to-right scan of generated SQL: string literals are consumed (and
+# ignored) so keywords inside them are not flagged, then any write/DDL
+# keyword, comment marker or second statement is reported by group name
+_SQL_SCAN_RE = re.compile(
+    r"(?P<literal>'(?:[^'\\]|\\.|'')*')"
+    r"|\b(?P<keyword>DROP|TRUNCATE|DELETE|ALTER|INSERT|UPDATE|CREATE|RENAME"
+    r"|ATTACH|DETACH|GRANT|REVOKE|KILL|OPTIMIZE|SYSTEM)\b"
+    r"|(?P<comment>--|/\*)"
+    r"|(?P<stacked>;(?=\s*\S))",
+    re.IGNORECASE
+)
+_READ_ONLY_SQL_RE = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+def _no_params(match: "re.Match[str]", query: str) -> Dict[str, str]:
+    return {}
+
+def _patient_params(match: "re.Match[str]", query: str) -> Dict[str, str]:
+    # FHIR ids are case-sensitive, so bind the id exactly as written
+    return {"patient_id": match.group("patient_id")}
+
+def _condition_params(match: "re.Match[str]", query: str) -> Dict[str, str]:
+    # condition_display is stored lower-cased, so a plain LIKE can use its
+    # index. LIKE treats '_' (which \w admits) as a single-character
+    # wildcard, so escape it to match literally
+    return {"condition": match.group("condition").lower().replace("_", "\\_")}
+
+# Template name -> parameter extractor; templates not listed take no parameters
+_TEMPLATE_EXTRACTORS: Dict[str, Callable[["re.Match[str]", str], Dict[str, str]]] = {
+    "count_patients_by_condition": _condition_params,
+    "recent_lab_results": _patient_params,
+    "active_medications": _patient_params,
+    "recent_vitals": _patient_params
+}
+
+# Schema and few-shot examples sent with every LLM request; built once at
+# import rather than per call
+_SCHEMA_CONTEXT = """
 Database: nexuscare_analytics
 Table: fhir_current
 
@@ -240,6 +71,11 @@ Columns:
 - sign: Int8 (1 = current version, -1 = deleted)
 - version_id: String
 - created_at: DateTime
+- effective_datetime: Nullable(DateTime64(3)) (materialized $.effectiveDateTime)
+- authored_on: Nullable(DateTime64(3)) (materialized $.authoredOn)
+- appointment_start: Nullable(DateTime64(3)) (materialized $.start)
+- recorded_date: Nullable(DateTime64(3)) (materialized $.recordedDate)
+- condition_display: String (materialized lowerUTF8 of $.code.coding[0].display, n-gram indexed)
 
 Common FHIR Resource Types:
 - Patient: Demographics and patient information
@@ -257,26 +93,24 @@ JSON Path Examples:
 - Condition code: $.code.coding[0].code
 - Medication name: $.medicationCodeableConcept.coding[0].display
 """
-    
-    def _get_few_shot_examples(self) -> List[Dict[str, str]]:
-        """Get few-shot examples for IASOQL"""
-        return [
-            {
-                "query": "Find all patients with diabetes diagnosed this year",
-                "sql": """SELECT DISTINCT JSONExtractString(resource, '$.subject.reference') as patient_id,
+
+_FEW_SHOT_EXAMPLES: Tuple[Dict[str, str], ...] = (
+    {
+        "query": "Find all patients with diabetes diagnosed this year",
+        "sql": """SELECT DISTINCT JSONExtractString(resource, '$.subject.reference') as patient_id,
        JSONExtractString(resource, '$.code.coding[0].display') as condition,
-       JSONExtractString(resource, '$.recordedDate') as diagnosis_date
+       recorded_date as diagnosis_date
 FROM nexuscare_analytics.fhir_current
 WHERE tenant_id = 'demo_tenant'
   AND sign = 1
   AND resource_type = 'Condition'
   AND (JSONExtractString(resource, '$.code.coding[0].code') LIKE 'E11%'
        OR JSONExtractString(resource, '$.code.coding[0].display') ILIKE '%diabetes%')
-  AND toYear(parseDateTimeBestEffort(JSONExtractString(resource, '$.recordedDate'))) = toYear(now())"""
-            },
-            {
-                "query": "Show lab results above normal range for patient 123",
-                "sql": """SELECT JSONExtractString(resource, '$.code.display') as test_name,
+  AND toYear(recorded_date) = toYear(now())"""
+    },
+    {
+        "query": "Show lab results above normal range for patient 123",
+        "sql": """SELECT JSONExtractString(resource, '$.code.display') as test_name,
        JSONExtractFloat(resource, '$.valueQuantity.value') as value,
        JSONExtractString(resource, '$.valueQuantity.unit') as unit,
        JSONExtractFloat(resource, '$.referenceRange[0].high.value') as upper_limit,
@@ -287,9 +121,303 @@ WHERE tenant_id = 'demo_tenant'
   AND resource_type = 'Observation'
   AND JSONExtractString(resource, '$.subject.reference') = 'Patient/123'
   AND JSONExtractString(resource, '$.interpretation[0].coding[0].code') IN ('H', 'HH', 'HU')
-ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.effectiveDateTime')) DESC"""
+ORDER BY effective_datetime DESC"""
+    }
+)
+
+# Schema context and examples never change, so encode them once; each request
+# body only serializes the query and RAG context and splices these bytes in
+# (the encoded object minus its braces)
+_STATIC_INPUT_JSON = orjson.dumps({
+    "schema_context": _SCHEMA_CONTEXT,
+    "examples": _FEW_SHOT_EXAMPLES
+})[1:-1]
+
+@lru_cache(maxsize=16)
+def _headers_for(api_key: str) -> Dict[str, str]:
+    """RunPod request headers, built once per distinct API key"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+@dataclass(frozen=True)
+class TemplateEntry:
+    """A query template, ready to match and render"""
+    name: str
+    pattern: "re.Pattern[str]"
+    sql: str
+    extract: Callable[["re.Match[str]", str], Dict[str, str]]
+
+# Common query templates
+_TEMPLATES: Dict[str, Dict[str, str]] = {
+    # Patient queries
+    "count_patients_by_condition": {
+        "pattern": r"(count|how many) patients? (have|with) (?P<condition>\w+)",
+        "sql": """
+            SELECT COUNT(DISTINCT JSONExtractString(resource, '$.subject.reference')) as patient_count
+            FROM nexuscare_analytics.fhir_current
+            WHERE tenant_id = {tenant_id:String}
+            AND sign = 1
+            AND resource_type = 'Condition'
+            AND condition_display LIKE concat('%', {condition:String}, '%')
+        """
+    },
+
+    # Lab result queries
+    "recent_lab_results": {
+        "pattern": r"(recent|latest) lab (results?|tests?) for patient (?P<patient_id>\w+)",
+        "sql": """
+            SELECT 
+                JSONExtractString(resource, '$.code.display') as test_name,
+                JSONExtractFloat(resource, '$.valueQuantity.value') as value,
+                JSONExtractString(resource, '$.valueQuantity.unit') as unit,
+                JSONExtractString(resource, '$.effectiveDateTime') as test_date,
+                JSONExtractString(resource, '$.interpretation[0].text') as interpretation
+            FROM nexuscare_analytics.fhir_current
+            WHERE tenant_id = {tenant_id:String}
+            AND sign = 1
+            AND resource_type = 'Observation'
+            AND JSONExtractString(resource, '$.subject.reference') = concat('Patient/', {patient_id:String})
+            ORDER BY effective_datetime DESC
+            LIMIT 20
+        """
+    },
+
+    # Medication queries
+    "active_medications": {
+        "pattern": r"(active|current) medications? for patient (?P<patient_id>\w+)",
+        "sql": """
+            SELECT 
+                JSONExtractString(resource, '$.medicationCodeableConcept.coding[0].display') as medication,
+                JSONExtractString(resource, '$.dosageInstruction[0].text') as dosage,
+                JSONExtractString(resource, '$.authoredOn') as prescribed_date,
+                JSONExtractString(resource, '$.status') as status
+            FROM nexuscare_analytics.fhir_current
+            WHERE tenant_id = {tenant_id:String}
+            AND sign = 1
+            AND resource_type = 'MedicationRequest'
+            AND JSONExtractString(resource, '$.subject.reference') = concat('Patient/', {patient_id:String})
+            AND JSONExtractString(resource, '$.status') = 'active'
+            ORDER BY authored_on DESC
+        """
+    },
+
+    # Appointment queries
+    "upcoming_appointments": {
+        "pattern": r"(upcoming|next|future) appointments?",
+        "sql": """
+            SELECT 
+                JSONExtractString(resource, '$.description') as description,
+                JSONExtractString(resource, '$.start') as appointment_time,
+                JSONExtractString(resource, '$.participant[0].actor.display') as provider,
+                JSONExtractString(resource, '$.status') as status
+            FROM nexuscare_analytics.fhir_current
+            WHERE tenant_id = {tenant_id:String}
+            AND sign = 1
+            AND resource_type = 'Appointment'
+            AND appointment_start > now()
+            ORDER BY appointment_start ASC
+            LIMIT 10
+        """
+    },
+
+    # Vital signs
+    "recent_vitals": {
+        "pattern": r"(recent|latest) vital signs? for patient (?P<patient_id>\w+)",
+        "sql": """
+            SELECT 
+                JSONExtractString(resource, '$.code.coding[0].display') as vital_type,
+                JSONExtractFloat(resource, '$.valueQuantity.value') as value,
+                JSONExtractString(resource, '$.valueQuantity.unit') as unit,
+                JSONExtractString(resource, '$.effectiveDateTime') as recorded_date
+            FROM nexuscare_analytics.fhir_current
+            WHERE tenant_id = {tenant_id:String}
+            AND sign = 1
+            AND resource_type = 'Observation'
+            AND JSONExtractString(resource, '$.subject.reference') = concat('Patient/', {patient_id:String})
+            AND JSONExtractString(resource, '$.category[0].coding[0].code') = 'vital-signs'
+            ORDER BY effective_datetime DESC
+            LIMIT 10
+        """
+    }
+}
+
+# Patterns are fixed, so compile them once at import instead of per
+# instance, and pick each template's parameter extractor up front
+_ENTRIES: Tuple[TemplateEntry, ...] = tuple(
+    TemplateEntry(
+        name=name,
+        pattern=re.compile(template["pattern"], re.IGNORECASE),
+        sql=template["sql"],
+        extract=_TEMPLATE_EXTRACTORS.get(name, _no_params)
+    )
+    for name, template in _TEMPLATES.items()
+)
+_ENTRIES_BY_NAME: Dict[str, TemplateEntry] = {
+    entry.name: entry for entry in _ENTRIES
+}
+
+# All patterns fused into one alternation so a query is scanned once
+# by the regex engine; the named group that matched picks the template
+_COMBINED_RE = re.compile(
+    "|".join(
+        f"(?P<{name}>{_NAMED_GROUP_RE.sub('(?:', template['pattern'])})"
+        for name, template in _TEMPLATES.items()
+    ),
+    re.IGNORECASE
+)
+
+class IasoQLTools:
+    """
+    Hybrid SQL generation combining templates and IASOQL LLM
+    """
+    
+    def __init__(self, runpod_api_key: str, iasoql_endpoint_id: str):
+        self.api_key = runpod_api_key
+        self.endpoint_id = iasoql_endpoint_id
+        self.base_url = f"https://api.runpod.ai/v2/{iasoql_endpoint_id}"
+        self.headers = _headers_for(runpod_api_key)
+        # Process-wide RunPod client, shared with the other tool servers so
+        # keep-alive connections are reused across them
+        self._client = get_http_client(30.0)
+        self._runsync_path = f"/{iasoql_endpoint_id}/runsync"
+        # Kept as an attribute for callers that inspect the templates
+        self.templates = _TEMPLATES
+    
+    def _match_entry(self, query: str) -> Optional[Tuple[TemplateEntry, "re.Match[str]"]]:
+        """Template whose pattern matches the query, with its match"""
+        combined = _COMBINED_RE.search(query)
+        if combined is None:
+            return None
+        
+        entry = _ENTRIES_BY_NAME[combined.lastgroup]
+        # Re-match the winning span with the template's own pattern so the
+        # extractors keep their per-template group numbering
+        return entry, entry.pattern.fullmatch(query, combined.start(), combined.end())
+    
+    def find_template_match(self, query: str) -> Optional[Dict[str, Any]]:
+        """Find matching template for the query"""
+        matched = self._match_entry(query.strip())
+        if matched is None:
+            return None
+        
+        entry, match = matched
+        return {
+            "template_name": entry.name,
+            "template": self.templates[entry.name],
+            "match_groups": match.groups()
+        }
+    
+    async def generate_sql_with_template(
+        self, 
+        query: str, 
+        tenant_id: str = "demo_tenant",
+        context: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Try template first, fall back to LLM if needed"""
+        
+        # Try to match a template
+        query = query.strip()
+        matched = self._match_entry(query) if len(query) <= MAX_TEMPLATE_QUERY_CHARS else None
+        
+        if matched:
+            entry, match = matched
+            logger.info(f"Found template match: {entry.name}")
+            
+            # Template SQL uses ClickHouse server-side parameters
+            # ({name:Type}); the executor binds these as param_<name>, so the
+            # query text stays constant per template and values are never
+            # spliced into it
+            return {
+                "sql": entry.sql,
+                "params": {"tenant_id": tenant_id, **entry.extract(match, query)},
+                "source": "template",
+                "template_name": entry.name,
+                "confidence": "high"
+            }
+        
+        # No template match - use IASOQL LLM
+        return await self.generate_sql_with_llm(query, context)
+    
+    async def generate_sql_with_llm(
+        self, 
+        query: str,
+        context: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Generate SQL using IASOQL LLM on RunPod"""
+        
+        # Prepare request: {"input": {query, rag_context, schema_context, examples}}
+        rag_context = context.get("rag_context", "") if context else ""
+        request_body = b"".join((
+            b'{"input":{"query":',
+            orjson.dumps(query),
+            b',"rag_context":',
+            orjson.dumps(rag_context),
+            b",",
+            _STATIC_INPUT_JSON,
+            b"}}"
+        ))
+        
+        # Call RunPod endpoint
+        response = await post_with_retry(
+            self._client,
+            self._runsync_path,
+            content=request_body,
+            headers=self.headers,
+            timeout=30.0
+        )
+        body = response.content
+        
+        if response.status_code != 200:
+            raise Exception(f"RunPod API error: {body.decode(errors='replace')}")
+        
+        result = orjson.loads(body)
+        
+        if result.get("status") == "COMPLETED":
+            output = result.get("output", {})
+            return {
+                "sql": output.get("sql"),
+                # Same shape as template results; LLM SQL has its values inline
+                "params": {},
+                "source": "llm",
+                "confidence": "medium",
+                "metadata": output.get("metadata", {})
             }
-        ]
+        else:
+            raise Exception(f"IASOQL generation failed: {result}")
+    
+    def validate_healthcare_sql(self, sql: str) -> Dict[str, Any]:
+        """Check that SQL is a single read-only statement"""
+        issues: List[str] = []
+        if not _READ_ONLY_SQL_RE.match(sql):
+            issues.append("Query must start with SELECT or WITH")
+        
+        for match in _SQL_SCAN_RE.finditer(sql):
+            kind = match.lastgroup
+            if kind == "keyword":
+                issues.append(f"Forbidden statement: {match.group('keyword').upper()}")
+            elif kind == "comment":
+                issues.append("SQL comments are not allowed")
+            elif kind == "stacked":
+                issues.append("Multiple statements are not allowed")
+        
+        return {
+            "valid": not issues,
+            "issues": list(dict.fromkeys(issues))
+        }
+    
+    async def aclose(self):
+        """Release the shared pool; call once at process shutdown"""
+        await close_http_client()
+    
+    def _get_schema_context(self) -> str:
+        """Get ClickHouse schema context"""
+        return _SCHEMA_CONTEXT
+    
+    def _get_few_shot_examples(self) -> Tuple[Dict[str, str], ...]:
+        """Get few-shot examples for IASOQL"""
+        return _FEW_SHOT_EXAMPLES
     
     # MCP Tool definitions
     def get_tool_definitions(self) -> List[Dict[str, Any]]:
@@ -297,7 +425,7 @@ ORDER BY parseDateTimeBestEffort(JSONExtractString(resource, '$.effectiveDateTim
         return [
             {
                 "name": "generate_healthcare_sql",
-                "description": "Generate ClickHouse SQL for healthcare analytics queries. Uses templates for common queries and IASOQL LLM for complex queries.",
+                "description": "Generate ClickHouse SQL for healthcare analytics queries. Uses templates for common queries and IASOQL LLM for complex queries. Returns \"sql\" plus \"params\": the SQL may contain ClickHouse query parameters ({name:Type}), and every entry in \"params\" must be bound as param_<name> when executing it.",
                 "input_schema": {
                     "type": "object",
                     "properties": {
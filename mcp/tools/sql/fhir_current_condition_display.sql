@@ -0,0 +1,17 @@
+-- Lower-cased condition display with an n-gram bloom filter index
+--
+-- count_patients_by_condition matches a substring of the condition display;
+-- the ngrambf_v1 index lets ClickHouse skip granules that cannot contain it
+-- instead of extracting and scanning the JSON display of every row.
+
+ALTER TABLE nexuscare_analytics.fhir_current
+    ADD COLUMN IF NOT EXISTS condition_display String
+        MATERIALIZED lowerUTF8(JSONExtractString(resource, '$.code.coding[0].display'));
+
+ALTER TABLE nexuscare_analytics.fhir_current
+    ADD INDEX IF NOT EXISTS idx_condition_display condition_display
+        TYPE ngrambf_v1(4, 8192, 3, 0) GRANULARITY 4;
+
+-- Backfill existing parts; new inserts are materialized automatically
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE COLUMN condition_display;
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE INDEX idx_condition_display;
@@ -0,0 +1,21 @@
+-- Materialized date columns for nexuscare_analytics.fhir_current
+--
+-- The IASOQL templates order and filter on these instead of re-parsing the
+-- JSON date on every row; ClickHouse computes them once at insert time.
+-- Run once per cluster before deploying templates that reference them.
+
+ALTER TABLE nexuscare_analytics.fhir_current
+    ADD COLUMN IF NOT EXISTS effective_datetime Nullable(DateTime64(3))
+        MATERIALIZED parseDateTime64BestEffortOrNull(JSONExtractString(resource, '$.effectiveDateTime'), 3),
+    ADD COLUMN IF NOT EXISTS authored_on Nullable(DateTime64(3))
+        MATERIALIZED parseDateTime64BestEffortOrNull(JSONExtractString(resource, '$.authoredOn'), 3),
+    ADD COLUMN IF NOT EXISTS appointment_start Nullable(DateTime64(3))
+        MATERIALIZED parseDateTime64BestEffortOrNull(JSONExtractString(resource, '$.start'), 3),
+    ADD COLUMN IF NOT EXISTS recorded_date Nullable(DateTime64(3))
+        MATERIALIZED parseDateTime64BestEffortOrNull(JSONExtractString(resource, '$.recordedDate'), 3);
+
+-- Backfill existing parts; new inserts are materialized automatically
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE COLUMN effective_datetime;
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE COLUMN authored_on;
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE COLUMN appointment_start;
+ALTER TABLE nexuscare_analytics.fhir_current MATERIALIZE COLUMN recorded_date;
@@ -5,20 +5,45 @@ Exposes Whisper transcription capabilities via Model Context Protocol
 """
 
 import asyncio
-import json
+import hashlib
 import os
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
 
 import httpx
+import orjson
 from mcp.server import Server
 from mcp.types import Tool, TextContent, ImageContent, EmbeddedResource
 from pydantic import BaseModel
 
+from shared.http_client import close_http_client, get_http_client, post_with_retry
+
 # RunPod configuration
 RUNPOD_API_KEY = os.getenv("RUNPOD_API_KEY")
 WHISPER_ENDPOINT_ID = os.getenv("WHISPER_ENDPOINT_ID", "rntxttrdl8uv3i")
-RUNPOD_API_URL = f"https://api.runpod.ai/v2/{WHISPER_ENDPOINT_ID}"
+RUNSYNC_PATH = f"/{WHISPER_ENDPOINT_ID}/runsync"
+TRANSCRIBE_TIMEOUT_SECONDS = 120.0
+
+# Recent transcriptions keyed by (audio, language, segments, vad); repeat calls
+# on the same audio (retries, debugging) skip a seconds-long Whisper run
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("WHISPER_RESULT_CACHE_TTL", "3600"))
+
+# Tool output is compact JSON; IASO_PRETTY_JSON=1 indents it for debugging
+_JSON_OPTIONS = orjson.OPT_INDENT_2 if os.getenv("IASO_PRETTY_JSON") == "1" else 0
+
+# (epoch second, ISO string) of the last timestamp handed out
+_timestamp_cache: Tuple[int, str] = (0, "")
+
+def _utcnow_iso() -> str:
+    """Timezone-aware UTC timestamp for tool responses, formatted once per second"""
+    global _timestamp_cache
+    second = int(time.time())
+    if _timestamp_cache[0] != second:
+        _timestamp_cache = (second, datetime.fromtimestamp(second, timezone.utc).isoformat())
+    return _timestamp_cache[1]
 
 class TranscriptionRequest(BaseModel):
     """Request model for transcription"""
@@ -33,6 +58,14 @@ class WhisperMCPServer:
     
     def __init__(self):
         self.server = Server("whisper-transcription-service")
+        # Process-wide RunPod client, shared with the other tool servers so
+        # keep-alive connections are reused across them
+        self._client = get_http_client()
+        self._headers = {
+            "Authorization": f"Bearer {RUNPOD_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        self._result_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
         self.setup_tools()
         
     def setup_tools(self):
@@ -119,133 +152,166 @@ class WhisperMCPServer:
             
             return [TextContent(
                 type="text",
-                text=json.dumps(result, indent=2)
+                text=orjson.dumps(result, option=_JSON_OPTIONS).decode()
             )]
     
-    async def call_runpod_endpoint(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+    async def call_runpod_endpoint(
+        self,
+        payload: Dict[str, Any],
+        keep_segments: bool = True
+    ) -> Dict[str, Any]:
         """Call RunPod Whisper endpoint"""
-        headers = {
-            "Authorization": f"Bearer {RUNPOD_API_KEY}",
-            "Content-Type": "application/json"
+        response = await post_with_retry(
+            self._client,
+            RUNSYNC_PATH,
+            json={"input": payload},
+            headers=self._headers,
+            timeout=TRANSCRIBE_TIMEOUT_SECONDS
+        )
+        body = response.content
+        
+        if response.status_code != 200:
+            return {"error": f"HTTP {response.status_code}: {body.decode(errors='replace')}"}
+        
+        result = orjson.loads(body)
+        if result.get("status") != "COMPLETED":
+            return {"error": f"Job failed: {result}"}
+        
+        output = result["output"]
+        if not keep_segments and isinstance(output, dict):
+            # Segment lists can run to megabytes; drop them as soon as the
+            # body is parsed when the caller will not return them
+            output.pop("segments", None)
+        return output
+    
+    async def _run_whisper(
+        self,
+        *,
+        audio: Optional[str],
+        language: Optional[str] = None,
+        return_segments: bool = False,
+        vad_filter: bool = True
+    ) -> Dict[str, Any]:
+        """Single path to the Whisper endpoint, reusing recent results for the same audio"""
+        if not audio:
+            return {"error": "No audio provided: pass audio_url or audio_base64"}
+        
+        # Hash rather than key on the audio itself: base64 payloads are large
+        cache_key = hashlib.blake2b(
+            orjson.dumps((audio, language, return_segments, vad_filter)),
+            digest_size=16
+        ).hexdigest()
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            stored_at, result = cached
+            if time.monotonic() - stored_at < RESULT_CACHE_TTL_SECONDS:
+                self._result_cache.move_to_end(cache_key)
+                return result
+            del self._result_cache[cache_key]
+        
+        payload: Dict[str, Any] = {
+            "audio": audio,
+            "return_segments": return_segments,
+            "vad_filter": vad_filter
         }
+        if language:
+            payload["language"] = language
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{RUNPOD_API_URL}/runsync",
-                headers=headers,
-                json={"input": payload}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("status") == "COMPLETED":
-                    return result["output"]
-                else:
-                    return {"error": f"Job failed: {result}"}
-            else:
-                return {"error": f"HTTP {response.status_code}: {response.text}"}
+        try:
+            result = await self.call_runpod_endpoint(payload, keep_segments=return_segments)
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            return {"error": f"Whisper call failed: {e!r}"}
+        except (KeyError, ValueError) as e:
+            # Malformed RunPod response (orjson.JSONDecodeError is a ValueError)
+            return {"error": f"Invalid response from Whisper: {e!r}"}
+        
+        # Only cache successes so failed calls are retried
+        if "error" not in result:
+            self._result_cache[cache_key] = (time.monotonic(), result)
+            if len(self._result_cache) > RESULT_CACHE_MAX_ENTRIES:
+                self._result_cache.popitem(last=False)
+        
+        return result
     
     async def transcribe_audio(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Transcribe audio to text"""
-        try:
-            payload = {
-                "audio": args.get("audio_url") or args.get("audio_base64"),
-                "return_segments": args.get("return_segments", False),
-                "vad_filter": args.get("vad_filter", True)
-            }
-            
-            if args.get("language"):
-                payload["language"] = args["language"]
-            
-            result = await self.call_runpod_endpoint(payload)
-            
-            if "error" in result:
-                return result
-            
-            return {
-                "transcription": result.get("transcription", ""),
-                "language": result.get("language", "unknown"),
-                "duration": result.get("duration", 0),
-                "processing_time": result.get("processing_time", 0),
-                "segments": result.get("segments", []) if args.get("return_segments") else None,
-                "service": "whisper-medium",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            return {"error": str(e)}
+        return_segments = bool(args.get("return_segments", False))
+        result = await self._run_whisper(
+            audio=args.get("audio_url") or args.get("audio_base64"),
+            language=args.get("language"),
+            return_segments=return_segments,
+            vad_filter=args.get("vad_filter", True)
+        )
+        
+        if "error" in result:
+            return result
+        
+        return {
+            "transcription": result.get("transcription", ""),
+            "language": result.get("language", "unknown"),
+            "duration": result.get("duration", 0),
+            "processing_time": result.get("processing_time", 0),
+            "segments": result.get("segments", []) if return_segments else None,
+            "service": "whisper-medium",
+            "timestamp": _utcnow_iso()
+        }
     
     async def transcribe_medical_dictation(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Transcribe medical dictation with optimized settings"""
-        try:
-            # Use specific settings optimized for medical dictation
-            payload = {
-                "audio": args["audio_url"],
-                "return_segments": True,  # Always return segments for medical
-                "vad_filter": True,
-                "language": "en"  # Medical dictation typically in English
-            }
-            
-            result = await self.call_runpod_endpoint(payload)
-            
-            if "error" in result:
-                return result
-            
-            # Add medical-specific metadata
-            response = {
-                "transcription": result.get("transcription", ""),
-                "speaker_info": args.get("speaker_info", "Unknown"),
-                "duration": result.get("duration", 0),
-                "processing_time": result.get("processing_time", 0),
-                "segments": result.get("segments", []),
-                "medical_dictation": True,
-                "timestamp": datetime.utcnow().isoformat(),
-                "metadata": {
-                    "service": "whisper-medical",
-                    "optimized_for": "medical_terminology",
-                    "post_processing": "medical_nlp_ready"
-                }
+        # Medical dictation is typically English and always returns segments
+        result = await self._run_whisper(
+            audio=args.get("audio_url"),
+            language="en",
+            return_segments=True
+        )
+        
+        if "error" in result:
+            return result
+        
+        # Add medical-specific metadata
+        return {
+            "transcription": result.get("transcription", ""),
+            "speaker_info": args.get("speaker_info", "Unknown"),
+            "duration": result.get("duration", 0),
+            "processing_time": result.get("processing_time", 0),
+            "segments": result.get("segments", []),
+            "medical_dictation": True,
+            "timestamp": _utcnow_iso(),
+            "metadata": {
+                "service": "whisper-medical",
+                "optimized_for": "medical_terminology",
+                "post_processing": "medical_nlp_ready"
             }
-            
-            return response
-            
-        except Exception as e:
-            return {"error": str(e)}
+        }
     
     async def detect_language(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """Detect language from audio"""
-        try:
-            # Transcribe a short segment to detect language
-            payload = {
-                "audio": args["audio_url"],
-                "return_segments": False,
-                "vad_filter": True
-            }
-            
-            result = await self.call_runpod_endpoint(payload)
-            
-            if "error" in result:
-                return result
-            
-            return {
-                "detected_language": result.get("language", "unknown"),
-                "confidence": "high" if result.get("language") else "low",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            return {"error": str(e)}
+        # Same call shape as a plain transcription, so a prior
+        # transcribe_audio of this audio is served from the cache
+        result = await self._run_whisper(audio=args.get("audio_url"))
+        
+        if "error" in result:
+            return result
+        
+        return {
+            "detected_language": result.get("language", "unknown"),
+            "confidence": "high" if result.get("language") else "low",
+            "timestamp": _utcnow_iso()
+        }
     
     async def run(self):
         """Run the MCP server"""
         from mcp.server.stdio import stdio_server
         
-        async with stdio_server() as (read_stream, write_stream):
-            await self.server.run(
-                read_stream,
-                write_stream,
-                self.server.create_initialization_options()
-            )
+        try:
+            async with stdio_server() as (read_stream, write_stream):
+                await self.server.run(
+                    read_stream,
+                    write_stream,
+                    self.server.create_initialization_options()
+                )
+        finally:
+            await close_http_client()
 
 def main():
     """Main entry point"""
@@ -6,126 +6,46 @@ Medical insights generation using quantized Phi-4
 import os
 import json
 import runpod
-from llama_cpp import Llama
 import logging
 import time
-import urllib.request
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Model configuration
-PHI_MODEL_URL = "https://huggingface.co/bartowski/microsoft_Phi-4-reasoning-plus-GGUF/resolve/main/microsoft_Phi-4-reasoning-plus-Q6_K_L.gguf"
+PHI_MODEL_REPO = "bartowski/microsoft_Phi-4-reasoning-plus-GGUF"
 # Use unique subdirectory for Phi-4 to avoid conflicts
 MODEL_DIR = "/runpod-volume/phi4/models" if os.path.exists("/runpod-volume") else "/models/phi4"
-PHI_MODEL_PATH = os.path.join(MODEL_DIR, "microsoft_Phi-4-reasoning-plus-Q6_K_L.gguf")
 
-# Initialize model globally
-phi_model = None
+# GGUF quant per device: Q6_K_L (12.28GB) when fully offloaded to the GPU;
+# on CPU decode is memory-bandwidth bound, so the smaller Q4_K_M (9.05GB) is
+# much faster for little quality loss. PHI4_GGUF_QUANT forces one.
+GPU_QUANT = "Q6_K_L"
+CPU_QUANT = "Q4_K_M"
+FORCED_QUANT = os.getenv("PHI4_GGUF_QUANT")
 
-def download_model_if_needed():
-    """Download Phi-4 model if not present."""
-    if not os.path.exists(PHI_MODEL_PATH):
-        logger.info(f"Downloading Phi-4-reasoning-plus Q6_K_L model (12.28GB)...")
-        os.makedirs(MODEL_DIR, exist_ok=True)
-        
-        def download_progress(block_num, block_size, total_size):
-            downloaded = block_num * block_size
-            percent = min(downloaded * 100.0 / total_size, 100)
-            print(f"Download progress: {percent:.1f}%", end='\r')
-        
-        try:
-            urllib.request.urlretrieve(PHI_MODEL_URL, PHI_MODEL_PATH, reporthook=download_progress)
-            print("\nModel downloaded successfully!")
-            logger.info(f"Model saved to {PHI_MODEL_PATH}")
-        except Exception as e:
-            logger.error(f"Failed to download model: {e}")
-            raise
+# Inference backend: "llama_cpp" (GGUF, default) or "vllm" (4-bit AWQ checkpoint,
+# PagedAttention + continuous batching; needs an image built with INSTALL_VLLM=1)
+PHI_BACKEND = os.getenv("PHI4_BACKEND", "llama_cpp")
+# AWQ checkpoint converted once with autoawq and stored on the volume
+VLLM_MODEL_PATH = os.getenv("PHI4_VLLM_MODEL", os.path.join(MODEL_DIR, "phi-4-reasoning-plus-awq"))
 
-def initialize_model():
-    """Initialize Phi-4 model if not already loaded."""
-    global phi_model
-    
-    if phi_model is None:
-        download_model_if_needed()
-        
-        logger.info("Loading Phi-4-reasoning-plus model...")
-        start_time = time.time()
-        
-        # Check for GPU
-        try:
-            import torch
-            cuda_available = torch.cuda.is_available()
-            if cuda_available:
-                logger.info(f"CUDA available: {torch.version.cuda}")
-                logger.info(f"GPU: {torch.cuda.get_device_name(0)}")
-                n_gpu_layers = -1  # Use all layers on GPU
-            else:
-                logger.warning("CUDA not available, using CPU")
-                n_gpu_layers = 0
-        except ImportError:
-            logger.warning("PyTorch not installed, assuming CPU mode")
-            n_gpu_layers = 0
-        
-        try:
-            phi_model = Llama(
-                model_path=PHI_MODEL_PATH,
-                n_ctx=32768,  # 32K context window for long medical documents
-                n_threads=min(8, os.cpu_count() or 8),
-                n_gpu_layers=n_gpu_layers,
-                verbose=False,
-                use_mlock=True,
-                use_mmap=True,
-                seed=-1,
-                f16_kv=True,
-                logits_all=False,
-                n_batch=512,
-                rope_scaling_type=1  # Enable RoPE scaling for full context
-            )
-            logger.info(f"Phi-4 model loaded in {time.time() - start_time:.2f}s")
-            logger.info(f"GPU layers: {n_gpu_layers}")
-        except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            raise
+STOP_SEQUENCES = ["<|end|>", "<|user|>", "<|system|>"]
 
-def handler(job):
-    """
-    RunPod handler for Phi-4 medical reasoning.
-    
-    Input format:
-    {
-        "input": {
-            "text": "Medical transcription or text to analyze",
-            "prompt_type": "medical_insights" (optional),
-            "max_tokens": 1024 (optional),
-            "temperature": 0.7 (optional)
-        }
-    }
-    """
-    try:
-        # Initialize model
-        initialize_model()
-        
-        # Get input
-        job_input = job["input"]
-        text = job_input.get("text", "")
-        prompt_type = job_input.get("prompt_type", "medical_insights")
-        max_tokens = job_input.get("max_tokens", 8192)  # Increased for complete medical summaries
-        temperature = job_input.get("temperature", 0.7)
-        
-        if not text:
-            raise ValueError("No text input provided")
-        
-        # Build prompt based on type
-        if prompt_type == "medical_insights":
-            prompt = f"""<|system|>
+# Prompt scaffolding per prompt_type as (prefix, suffix) around the input text.
+# The prefixes are identical across requests, so their KV state is prefilled
+# once at load (see cache_prompt_prefixes) instead of on every call.
+PROMPT_TEMPLATES = {
+    "medical_insights": (
+        """<|system|>
 You are an expert medical documentation assistant. You MUST structure your response with <think> tags for reasoning and <solution> tags for the final answer.
 <|end|>
 <|user|>
 Analyze this medical transcription:
 
-{text}
+""",
+        """
 
 YOU MUST structure your response EXACTLY like this:
 
@@ -143,15 +63,17 @@ YOU MUST structure your response EXACTLY like this:
 </solution>
 <|end|>
 <|assistant|><think>"""
-        elif prompt_type == "soap":
-            prompt = f"""<|system|>
+    ),
+    "soap": (
+        """<|system|>
 You are an expert medical scribe. Convert the transcription into a properly formatted SOAP note using active voice and complete clinical details.
 IMPORTANT: Show your analysis in <think>...</think> tags, then provide the final SOAP note in <solution>...</solution> tags.
 <|end|>
 <|user|>
 Convert this medical transcription into a SOAP note:
 
-{text}
+""",
+        """
 
 First, analyze the information in <think> tags, then format your SOAP note in <solution> tags EXACTLY as follows:
 
@@ -185,15 +107,17 @@ PLAN:
 Important: Use active voice, include ALL clinical details, and maintain exact terminology from the source.
 <|end|>
 <|assistant|><think>"""
-        elif prompt_type == "summary":
-            prompt = f"""<|system|>
+    ),
+    "summary": (
+        """<|system|>
 You are a medical documentation specialist. Create a concise clinical summary using active voice and complete medical details.
 IMPORTANT: Show your analysis in <think>...</think> tags, then provide your final summary in <solution>...</solution> tags.
 <|end|>
 <|user|>
 Summarize this medical encounter:
 
-{text}
+""",
+        """
 
 First, analyze the key information in <think> tags, then provide your clinical summary in <solution> tags including:
 - Chief complaint
@@ -215,26 +139,247 @@ Important guidelines:
 Keep it complete but concise.
 <|end|>
 <|assistant|><think>"""
-        else:
-            # Use text as direct prompt
-            prompt = text
+    )
+}
+
+# Initialize model globally
+phi_model = None
+# GGUF quant that was loaded, reported with each response
+phi_quant = None
+# prompt_type -> llama.cpp state after evaluating that prompt's prefix
+_prefix_states = {}
+# prompt_type -> (prefix tokens, suffix tokens), tokenized once at load
+_prompt_tokens = {}
+
+def model_path_for(quant):
+    """Local path of the GGUF file for a quant."""
+    return os.path.join(MODEL_DIR, f"microsoft_Phi-4-reasoning-plus-{quant}.gguf")
+
+def download_model_if_needed(quant):
+    """Download Phi-4 model if not present."""
+    model_path = model_path_for(quant)
+    if not os.path.exists(model_path):
+        from huggingface_hub import hf_hub_download
         
-        # Generate response
-        logger.info("Generating medical insights...")
+        logger.info(f"Downloading Phi-4-reasoning-plus {quant} model...")
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        
+        # Resumes partial downloads, and with HF_HUB_ENABLE_HF_TRANSFER=1
+        # (set in the image) fetches in parallel ranged chunks
+        try:
+            hf_hub_download(
+                repo_id=PHI_MODEL_REPO,
+                filename=os.path.basename(model_path),
+                local_dir=MODEL_DIR
+            )
+            logger.info(f"Model saved to {model_path}")
+        except Exception as e:
+            logger.error(f"Failed to download model: {e}")
+            raise
+
+def initialize_model():
+    """Initialize Phi-4 model if not already loaded."""
+    global phi_model, phi_quant
+    
+    if phi_model is None and PHI_BACKEND == "vllm":
+        initialize_vllm_model()
+    
+    if phi_model is None:
+        from llama_cpp import Llama
+        
+        # Check for GPU
+        try:
+            import torch
+            cuda_available = torch.cuda.is_available()
+            if cuda_available:
+                logger.info(f"CUDA available: {torch.version.cuda}")
+                logger.info(f"GPU: {torch.cuda.get_device_name(0)}")
+                n_gpu_layers = -1  # Use all layers on GPU
+            else:
+                logger.warning("CUDA not available, using CPU")
+                n_gpu_layers = 0
+        except ImportError:
+            logger.warning("PyTorch not installed, assuming CPU mode")
+            n_gpu_layers = 0
+        
+        quant = FORCED_QUANT or (GPU_QUANT if n_gpu_layers == -1 else CPU_QUANT)
+        download_model_if_needed(quant)
+        
+        logger.info(f"Loading Phi-4-reasoning-plus {quant} model...")
         start_time = time.time()
         
-        response = phi_model(
-            prompt,
+        try:
+            phi_model = Llama(
+                model_path=model_path_for(quant),
+                n_ctx=32768,  # 32K context window for long medical documents
+                n_threads=min(8, os.cpu_count() or 8),
+                n_gpu_layers=n_gpu_layers,
+                verbose=False,
+                # Fully offloaded weights live in VRAM; pinning the host copy
+                # would only double RSS. Keep pages locked on CPU, where a
+                # page-out would stall every token
+                use_mlock=n_gpu_layers != -1,
+                use_mmap=True,
+                seed=-1,
+                f16_kv=True,
+                logits_all=False,
+                n_batch=2048,  # Larger prefill tiles; FlashAttention gains scale with batch
+                flash_attn=True,  # Fused attention kernels: less KV traffic at 32K context
+                rope_scaling_type=1  # Enable RoPE scaling for full context
+            )
+            phi_quant = quant
+            logger.info(f"Phi-4 model loaded in {time.time() - start_time:.2f}s")
+            logger.info(f"GPU layers: {n_gpu_layers}")
+        except Exception as e:
+            logger.error(f"Failed to load model: {e}")
+            raise
+        
+        cache_prompt_prefixes()
+
+def cache_prompt_prefixes():
+    """Tokenize the prompt scaffolding once, then prefill each prefix and keep its KV state."""
+    start_time = time.time()
+    try:
+        for prompt_type, (prefix, suffix) in PROMPT_TEMPLATES.items():
+            prefix_tokens = phi_model.tokenize(prefix.encode("utf-8"), special=True)
+            suffix_tokens = phi_model.tokenize(suffix.encode("utf-8"), add_bos=False, special=True)
+            _prompt_tokens[prompt_type] = (prefix_tokens, suffix_tokens)
+            
+            phi_model.reset()
+            phi_model.eval(prefix_tokens)
+            state = phi_model.save_state()
+            # save_state also copies a logits row per evaluated token (up to
+            # n_batch rows x ~100k vocab floats). The request always evaluates
+            # more tokens after the prefix, so only the last row is kept;
+            # load_state broadcasts it back over the restored rows
+            state.scores = state.scores[-1:].copy()
+            _prefix_states[prompt_type] = state
+        phi_model.reset()
+        state_bytes = sum(
+            len(state.llama_state) + state.scores.nbytes
+            for state in _prefix_states.values()
+        )
+        logger.info(
+            f"Cached {len(_prefix_states)} prompt prefixes "
+            f"({state_bytes / 1e6:.1f} MB) in {time.time() - start_time:.2f}s"
+        )
+    except Exception as e:
+        # Only an optimization: requests still work, they just prefill in full
+        _prefix_states.clear()
+        _prompt_tokens.clear()
+        logger.warning(f"Failed to cache prompt prefixes: {e}")
+
+def initialize_vllm_model():
+    """Load the AWQ Phi-4 checkpoint with vLLM."""
+    global phi_model
+    
+    from vllm import LLM
+    
+    logger.info(f"Loading Phi-4-reasoning-plus AWQ model with vLLM from {VLLM_MODEL_PATH}...")
+    start_time = time.time()
+    try:
+        phi_model = LLM(
+            model=VLLM_MODEL_PATH,
+            quantization="awq",
+            max_model_len=32768,
+            gpu_memory_utilization=0.9,
+            enable_prefix_caching=True
+        )
+        logger.info(f"Phi-4 model loaded in {time.time() - start_time:.2f}s")
+    except Exception as e:
+        logger.error(f"Failed to load model: {e}")
+        raise
+
+def generate(prompt, max_tokens, temperature):
+    """
+    Run one completion on the active backend; returns (text, completion_tokens).
+    
+    prompt is a string, or for llama.cpp a list of token IDs.
+    """
+    if PHI_BACKEND == "vllm":
+        from vllm import SamplingParams
+        
+        sampling = SamplingParams(
             max_tokens=max_tokens,
             temperature=temperature,
             top_p=0.9,
             top_k=40,
-            repeat_penalty=1.1,
-            stop=["<|end|>", "<|user|>", "<|system|>"]
+            repetition_penalty=1.1,
+            stop=STOP_SEQUENCES
         )
+        completion = phi_model.generate([prompt], sampling)[0].outputs[0]
+        return completion.text, len(completion.token_ids)
+    
+    response = phi_model(
+        prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=0.9,
+        top_k=40,
+        repeat_penalty=1.1,
+        stop=STOP_SEQUENCES
+    )
+    return response['choices'][0]['text'], response['usage']['completion_tokens']
+
+def handler(job):
+    """
+    RunPod handler for Phi-4 medical reasoning.
+    
+    Input format:
+    {
+        "input": {
+            "text": "Medical transcription or text to analyze",
+            "prompt_type": "medical_insights" (optional),
+            "max_tokens": 1024 (optional),
+            "temperature": 0.7 (optional)
+        }
+    }
+    """
+    try:
+        # Initialize model
+        initialize_model()
+        
+        # Get input
+        job_input = job["input"]
+        text = job_input.get("text", "")
+        prompt_type = job_input.get("prompt_type", "medical_insights")
+        max_tokens = job_input.get("max_tokens", 8192)  # Increased for complete medical summaries
+        temperature = job_input.get("temperature", 0.7)
+        
+        if not text:
+            raise ValueError("No text input provided")
+        
+        # Build prompt based on type
+        if prompt_type in _prompt_tokens:
+            # llama.cpp accepts token IDs directly: only the transcription is
+            # tokenized per request, as plain text so it cannot inject
+            # special tokens
+            prefix_tokens, suffix_tokens = _prompt_tokens[prompt_type]
+            text_tokens = phi_model.tokenize(text.encode("utf-8"), add_bos=False)
+            prompt = prefix_tokens + text_tokens + suffix_tokens
+        elif prompt_type in PROMPT_TEMPLATES:
+            prefix, suffix = PROMPT_TEMPLATES[prompt_type]
+            # One allocation for the full prompt, no intermediate prefix + text copy
+            prompt = "".join((prefix, text, suffix))
+        else:
+            # Use text as direct prompt
+            prompt = text
+        
+        # Generate response
+        logger.info("Generating medical insights...")
+        start_time = time.time()
+        
+        if prompt_type in _prefix_states:
+            # llama.cpp reuses the longest evaluated token prefix, so only the
+            # text and suffix are prefilled
+            restore_start = time.time()
+            phi_model.load_state(_prefix_states[prompt_type])
+            logger.info(f"Restored {prompt_type} prefix state in {(time.time() - restore_start) * 1000:.1f}ms")
+        
+        generated_text, completion_tokens = generate(prompt, max_tokens, temperature)
         
         generation_time = time.time() - start_time
-        generated_text = response['choices'][0]['text'].strip()
+        generated_text = generated_text.strip()
         
         # Ensure proper tag closure for structured prompts
         if prompt_type in ["medical_insights", "soap", "summary"]:
@@ -248,15 +393,15 @@ Keep it complete but concise.
                 generated_text += "\n<solution>\n[Response was incomplete]\n</solution>"
         
         # Log performance metrics
-        tokens_per_second = response['usage']['completion_tokens'] / generation_time if generation_time > 0 else 0
-        logger.info(f"Generated {response['usage']['completion_tokens']} tokens in {generation_time:.2f}s ({tokens_per_second:.1f} tokens/s)")
+        tokens_per_second = completion_tokens / generation_time if generation_time > 0 else 0
+        logger.info(f"Generated {completion_tokens} tokens in {generation_time:.2f}s ({tokens_per_second:.1f} tokens/s)")
         
         return {
             "insights": generated_text,
             "processing_time": generation_time,
-            "tokens_generated": response['usage']['completion_tokens'],
+            "tokens_generated": completion_tokens,
             "tokens_per_second": round(tokens_per_second, 1),
-            "model": "phi-4-reasoning-plus-Q6_K_L"
+            "model": "phi-4-reasoning-plus-AWQ" if PHI_BACKEND == "vllm" else f"phi-4-reasoning-plus-{phi_quant}"
         }
         
     except Exception as e:
@@ -6,9 +6,81 @@ Handles separation of reasoning and solution sections for frontend display
 import re
 from typing import Dict, Optional, Tuple
 
+def _find_section(text: str, open_tag: str, close_tag: str) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Locate the first complete open_tag...close_tag section with plain
+    substring searches (same result as a lazy DOTALL regex, without the
+    regex engine).
+    
+    Returns:
+        (section_start, content_start, content_end, section_end) or None
+    """
+    start = text.find(open_tag)
+    if start == -1:
+        return None
+    content_start = start + len(open_tag)
+    content_end = text.find(close_tag, content_start)
+    if content_end == -1:
+        return None
+    return start, content_start, content_end, content_end + len(close_tag)
+
+class Phi4StreamParser:
+    """
+    Incremental think/solution extraction for streamed output.
+    
+    Chunks are appended to one bytearray and each section keeps its own scan
+    offset, so every byte is searched about once over the whole stream; the
+    buffer is never rewritten. Each section is reported once, the first time
+    it completes.
+    """
+    
+    _TAGS = ((b"<think>", b"</think>"), (b"<solution>", b"</solution>"))
+    
+    def __init__(self):
+        self.buffer = bytearray()
+        # Per section: next offset to scan, content start once the opening
+        # tag is seen (-1 before), and whether it has been reported
+        self.pos = [0, 0]
+        self.content_start = [-1, -1]
+        self.done = [False, False]
+    
+    def feed(self, chunk: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Append a chunk.
+        
+        Returns:
+            Tuple of (reasoning_if_just_completed, solution_if_just_completed)
+        """
+        self.buffer += chunk.encode("utf-8")
+        return self._advance(0), self._advance(1)
+    
+    def _advance(self, section: int) -> Optional[str]:
+        if self.done[section]:
+            return None
+        open_tag, close_tag = self._TAGS[section]
+        
+        if self.content_start[section] == -1:
+            at = self.buffer.find(open_tag, self.pos[section])
+            if at == -1:
+                # The tag may be split across chunks; rescan only the tail
+                self.pos[section] = max(self.pos[section], len(self.buffer) - len(open_tag) + 1)
+                return None
+            self.content_start[section] = self.pos[section] = at + len(open_tag)
+        
+        end = self.buffer.find(close_tag, self.pos[section])
+        if end == -1:
+            self.pos[section] = max(self.pos[section], len(self.buffer) - len(close_tag) + 1)
+            return None
+        
+        self.done[section] = True
+        # Tags are ASCII, so these offsets always fall on UTF-8 boundaries
+        content = memoryview(self.buffer)[self.content_start[section]:end]
+        return str(content, "utf-8").strip()
+
 class Phi4ResponseParser:
     """Parser for Phi-4 responses with think/solution tags"""
     
+    # Equivalent patterns, kept for callers; parsing uses _find_section
     THINK_PATTERN = re.compile(r'<think>(.*?)</think>', re.DOTALL)
     SOLUTION_PATTERN = re.compile(r'<solution>(.*?)</solution>', re.DOTALL)
     
@@ -27,13 +99,13 @@ class Phi4ResponseParser:
                 - has_tags: Whether both tags were found
                 - raw: Original response
         """
-        think_match = cls.THINK_PATTERN.search(response)
-        solution_match = cls.SOLUTION_PATTERN.search(response)
+        think = _find_section(response, "<think>", "</think>")
+        solution = _find_section(response, "<solution>", "</solution>")
         
         return {
-            "reasoning": think_match.group(1).strip() if think_match else "",
-            "solution": solution_match.group(1).strip() if solution_match else response.strip(),
-            "has_tags": bool(think_match and solution_match),
+            "reasoning": response[think[1]:think[2]].strip() if think else "",
+            "solution": response[solution[1]:solution[2]].strip() if solution else response.strip(),
+            "has_tags": bool(think and solution),
             "raw": response
         }
     
@@ -54,23 +126,39 @@ class Phi4ResponseParser:
         solution_complete = None
         
         # Check if we have a complete <think> section
-        if "</think>" in buffer and "<think>" in buffer:
-            match = cls.THINK_PATTERN.search(buffer)
-            if match:
-                reasoning_complete = match.group(1).strip()
-                # Remove the completed think section from buffer
-                buffer = buffer.replace(match.group(0), "", 1)
+        section = _find_section(buffer, "<think>", "</think>")
+        if section:
+            reasoning_complete = buffer[section[1]:section[2]].strip()
+            # Remove the completed think section from buffer
+            buffer = buffer[:section[0]] + buffer[section[3]:]
         
         # Check if we have a complete <solution> section
-        if "</solution>" in buffer and "<solution>" in buffer:
-            match = cls.SOLUTION_PATTERN.search(buffer)
-            if match:
-                solution_complete = match.group(1).strip()
-                # Remove the completed solution section from buffer
-                buffer = buffer.replace(match.group(0), "", 1)
+        section = _find_section(buffer, "<solution>", "</solution>")
+        if section:
+            solution_complete = buffer[section[1]:section[2]].strip()
+            # Remove the completed solution section from buffer
+            buffer = buffer[:section[0]] + buffer[section[3]:]
         
         return reasoning_complete, solution_complete, buffer
     
+    @classmethod
+    def parse_stream_chunk(cls, chunk: str, state: Dict[str, any]) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Stateful alternative to parse_streaming: scans each chunk once
+        instead of re-searching and rebuilding the whole buffer.
+        
+        Args:
+            chunk: New chunk of text
+            state: Dict owned by the caller, empty on the first chunk
+            
+        Returns:
+            Tuple of (reasoning_if_complete, solution_if_complete)
+        """
+        parser = state.get("parser")
+        if parser is None:
+            parser = state["parser"] = Phi4StreamParser()
+        return parser.feed(chunk)
+    
     @classmethod
     def format_for_display(cls, parsed_response: Dict[str, any], format_type: str = "text") -> str:
         """
@@ -135,9 +223,9 @@ else:
     show_full_response(parsed["raw"])
 
 # For streaming response:
-buffer = ""
+state = {}
 for chunk in stream:
-    reasoning, solution, buffer = parser.parse_streaming(chunk, buffer)
+    reasoning, solution = parser.parse_stream_chunk(chunk, state)
     if reasoning:
         update_reasoning_display(reasoning)
     if solution:
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Phi-4 think/solution response parser
+Run with: pytest phi4/test_response_parser.py
+"""
+
+import pytest
+
+from response_parser import Phi4ResponseParser
+
+TAGGED_RESPONSE = """<think>
+Fever and productive cough for 3 days; crackles at the right base.
+</think>
+<solution>
+Assessment: community-acquired pneumonia. Plan: chest X-ray, amoxicillin.
+</solution>"""
+
+def test_parse_splits_reasoning_and_solution():
+    parsed = Phi4ResponseParser.parse(TAGGED_RESPONSE)
+
+    assert parsed["has_tags"] is True
+    assert parsed["reasoning"] == "Fever and productive cough for 3 days; crackles at the right base."
+    assert parsed["solution"] == "Assessment: community-acquired pneumonia. Plan: chest X-ray, amoxicillin."
+    assert parsed["raw"] == TAGGED_RESPONSE
+
+def test_parse_untagged_response_is_the_solution():
+    parsed = Phi4ResponseParser.parse("  Plain summary without tags.  ")
+
+    assert parsed == {
+        "reasoning": "",
+        "solution": "Plain summary without tags.",
+        "has_tags": False,
+        "raw": "  Plain summary without tags.  "
+    }
+
+@pytest.mark.parametrize("response", [
+    TAGGED_RESPONSE,
+    "<think>a</think><think>b</think><solution>c</solution>",
+    "<think>unclosed <solution>x</solution>",
+    "<solution>only a solution</solution>",
+    "</think>stray close<think>late</think>",
+    "<think></think><solution>\n</solution>",
+])
+def test_parse_matches_the_regex_patterns(response):
+    parsed = Phi4ResponseParser.parse(response)
+    think = Phi4ResponseParser.THINK_PATTERN.search(response)
+    solution = Phi4ResponseParser.SOLUTION_PATTERN.search(response)
+
+    assert parsed["reasoning"] == (think.group(1).strip() if think else "")
+    assert parsed["solution"] == (solution.group(1).strip() if solution else response.strip())
+    assert parsed["has_tags"] == bool(think and solution)
+
+def test_parse_streaming_removes_completed_sections_from_buffer():
+    reasoning, solution, buffer = Phi4ResponseParser.parse_streaming("<think>why</think> tail", "")
+
+    assert (reasoning, solution, buffer) == ("why", None, " tail")
+
+def chunks_of(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 10000])
+def test_stream_chunk_reports_each_section_once(size):
+    state = {}
+    reasoning, solution = [], []
+    for chunk in chunks_of(TAGGED_RESPONSE, size):
+        done_reasoning, done_solution = Phi4ResponseParser.parse_stream_chunk(chunk, state)
+        if done_reasoning is not None:
+            reasoning.append(done_reasoning)
+        if done_solution is not None:
+            solution.append(done_solution)
+
+    parsed = Phi4ResponseParser.parse(TAGGED_RESPONSE)
+    assert reasoning == [parsed["reasoning"]]
+    assert solution == [parsed["solution"]]
+
+def test_stream_chunk_handles_multibyte_text_split_across_chunks():
+    response = "<think>Température 39°C — dyspnée</think><solution>Pneumonie → antibiotiques</solution>"
+    state = {}
+    results = [Phi4ResponseParser.parse_stream_chunk(chunk, state) for chunk in chunks_of(response, 1)]
+
+    assert [r for r, _ in results if r is not None] == ["Température 39°C — dyspnée"]
+    assert [s for _, s in results if s is not None] == ["Pneumonie → antibiotiques"]
+
+def test_stream_chunk_waits_for_closing_tag():
+    state = {}
+
+    assert Phi4ResponseParser.parse_stream_chunk("<think>partial", state) == (None, None)
+    assert Phi4ResponseParser.parse_stream_chunk(" reasoning</thi", state) == (None, None)
+    assert Phi4ResponseParser.parse_stream_chunk("nk>", state) == ("partial reasoning", None)
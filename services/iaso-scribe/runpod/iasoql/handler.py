@@ -3,15 +3,17 @@ IASOQL RunPod Handler - Healthcare SQL Generation
 Optimized for ClickHouse queries on FHIR data
 """
 
+import asyncio
 import runpod
 import torch
 import json
 import re
 import os
-import sys
+import gc
+import time
+import importlib.util
 import logging
 from typing import Dict, Any, List, Optional
-from datetime import datetime
 
 # Setup logging
 logging.basicConfig(
@@ -20,27 +22,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Import transformers components
-try:
-    from transformers import (
-        AutoModelForCausalLM, 
-        AutoTokenizer,
-        BitsAndBytesConfig,
-        GenerationConfig
-    )
-except ImportError as e:
-    logger.error(f"Failed to import transformers: {e}")
-    sys.exit(1)
+# transformers is imported lazily in load_model so the worker starts polling
+# for jobs without paying its import cost; keep its startup checks quiet
+os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
+os.environ.setdefault("HF_HUB_DISABLE_PROGRESS_BARS", "1")
 
 # Model configuration
 MODEL_NAME = os.environ.get("MODEL_NAME", "vivkris/iasoql-7B")
 # Use unique subdirectory for IASOQL to avoid conflicts with other endpoints
 CACHE_DIR = "/runpod-volume/iasoql/cache" if os.path.exists("/runpod-volume") else "/tmp/iasoql-cache"
 
+# Requests at or below this temperature are decoded greedily
+SAMPLING_TEMPERATURE_THRESHOLD = 0.15
+
+# Allow TF32 tensor cores for any residual FP32 matmuls
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+# Single-pass SQL safety scan: write operations and injection tokens
+_DANGEROUS_KEYWORDS = ('DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE', 'GRANT', 'REVOKE')
+_DANGER_RE = re.compile(r'\b(' + '|'.join(_DANGEROUS_KEYWORDS) + r'|EXEC|EXECUTE)\b|;')
+_INJECTION_TOKENS = frozenset([';', 'EXEC', 'EXECUTE'])
+
+# SQL extraction patterns
+_SQL_FENCE_RE = re.compile(r'```sql\n(.*?)\n```', re.DOTALL | re.IGNORECASE)
+_SQL_MARKER_RE = re.compile(r'SQL:\s*(.*?)(?:\n\n|$)', re.DOTALL)
+_SELECT_RE = re.compile(r'(SELECT\s+.*?)(?:\n\n|$)', re.DOTALL | re.IGNORECASE)
+
+# Intra-worker batching: concurrent jobs arriving within the window are
+# coalesced into a single padded model.generate call
+MAX_BATCH_SIZE = int(os.environ.get("IASOQL_MAX_BATCH_SIZE", "8"))
+BATCH_WINDOW_SECONDS = float(os.environ.get("IASOQL_BATCH_WINDOW_MS", "5")) / 1000
+
 # Global model instance
 model = None
 tokenizer = None
 generation_config = None
+sql_stop_token_ids = []
+model_device = None
+model_is_cuda = False
+
+# Batching state, bound to the RunPod event loop on first use
+request_queue = asyncio.Queue()
+model_load_lock = asyncio.Lock()
+batch_worker = None
 
 def setup_cuda():
     """Setup CUDA environment and check availability"""
@@ -55,9 +80,17 @@ def setup_cuda():
         logger.warning("CUDA not available, using CPU")
         return "cpu"
 
+def find_sql_stop_token_ids(tok) -> List[int]:
+    """Find vocabulary tokens that end a generated SQL statement"""
+    token_texts = tok.batch_decode([[token_id] for token_id in range(len(tok))])
+    return [
+        token_id for token_id, text in enumerate(token_texts)
+        if ";" in text or "\n\n" in text
+    ]
+
 def load_model():
     """Load IASOQL model with proper error handling"""
-    global model, tokenizer, generation_config
+    global model, tokenizer, generation_config, sql_stop_token_ids, model_device, model_is_cuda
     
     logger.info("="*60)
     logger.info("IASOQL Handler Starting - Healthcare SQL Generation")
@@ -65,6 +98,18 @@ def load_model():
     logger.info(f"Loading model: {MODEL_NAME}")
     logger.info(f"Cache directory: {CACHE_DIR}")
     
+    # Import transformers components
+    try:
+        from transformers import (
+            AutoModelForCausalLM, 
+            AutoTokenizer,
+            BitsAndBytesConfig,
+            GenerationConfig
+        )
+    except ImportError as e:
+        logger.error(f"Failed to import transformers: {e}")
+        raise
+    
     # Setup device
     device = setup_cuda()
     
@@ -111,14 +156,32 @@ def load_model():
             tokenizer.pad_token = tokenizer.eos_token
             logger.info("Set pad_token to eos_token")
         
+        # Causal LM: pad on the left so batched prompts end at the same position
+        tokenizer.padding_side = "left"
+        
+        # Pick dtype and attention kernel for the GPU generation
+        # BF16 on Ampere/Hopper (compute capability 8.x+), FP16 otherwise
+        if device == "cuda":
+            torch_dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+            if importlib.util.find_spec("flash_attn") is not None:
+                attn_implementation = "flash_attention_2"
+            else:
+                attn_implementation = "sdpa"
+        else:
+            torch_dtype = torch.float32
+            attn_implementation = "sdpa"
+        logger.info(f"Using dtype {torch_dtype} with {attn_implementation} attention")
+        
         # Load model
         logger.info(f"Loading model from {MODEL_NAME}")
         model_kwargs = {
             "cache_dir": CACHE_DIR,
             "token": hf_token,
             "trust_remote_code": True,
-            "torch_dtype": torch.float16 if device == "cuda" else torch.float32,
+            "torch_dtype": torch_dtype,
             "low_cpu_mem_usage": True,
+            "use_safetensors": True,
+            "attn_implementation": attn_implementation,
         }
         
         if quantization_config:
@@ -127,26 +190,50 @@ def load_model():
         elif device == "cuda":
             model_kwargs["device_map"] = "auto"
         
-        model = AutoModelForCausalLM.from_pretrained(
-            MODEL_NAME,
-            **model_kwargs
-        )
+        try:
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_NAME,
+                **model_kwargs
+            )
+        except (ImportError, ValueError) as e:
+            if attn_implementation == "sdpa":
+                raise
+            logger.warning(f"FlashAttention-2 unavailable ({e}), falling back to SDPA")
+            model_kwargs["attn_implementation"] = "sdpa"
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_NAME,
+                **model_kwargs
+            )
         
         # Set model to evaluation mode
         model.eval()
         
+        # Resolve the input device once instead of per request
+        model_device = next(model.parameters()).device
+        model_is_cuda = model_device.type == "cuda"
+        
+        # Stop as soon as the statement is terminated (';') or the model
+        # starts a new few-shot block ('\n\n'), instead of decoding up to
+        # max_new_tokens and throwing the tail away
+        sql_stop_token_ids = find_sql_stop_token_ids(tokenizer)
+        logger.info(f"Found {len(sql_stop_token_ids)} SQL stop tokens")
+        
         # Setup generation config
+        # Greedy decoding by default: T=0.1 sampling is effectively greedy
+        # but still pays for top-p sorting and an RNG draw every token
         generation_config = GenerationConfig(
-            do_sample=True,
-            temperature=0.1,  # Low temperature for SQL generation
-            top_p=0.95,
+            do_sample=False,
+            num_beams=1,
+            use_cache=True,
+            early_stopping=False,
+            repetition_penalty=1.0,
             max_new_tokens=512,
             pad_token_id=tokenizer.pad_token_id,
-            eos_token_id=tokenizer.eos_token_id,
+            eos_token_id=[tokenizer.eos_token_id, *sql_stop_token_ids],
         )
         
         logger.info("Model loaded successfully")
-        logger.info(f"Model device: {next(model.parameters()).device}")
+        logger.info(f"Model device: {model_device}")
         
         # Log memory usage
         if device == "cuda":
@@ -154,6 +241,11 @@ def load_model():
             reserved = torch.cuda.memory_reserved() / 1e9
             logger.info(f"GPU memory - Allocated: {allocated:.2f} GB, Reserved: {reserved:.2f} GB")
         
+        # Collect load-time garbage once, then move everything that survived
+        # into the permanent generation so steady-state GCs skip the model
+        gc.collect()
+        gc.freeze()
+        
     except Exception as e:
         logger.error(f"Error loading model: {e}", exc_info=True)
         raise
@@ -210,16 +302,20 @@ SQL:"""
 def validate_sql(sql: str) -> Dict[str, Any]:
     """Validate generated SQL for safety and correctness"""
     
-    # Remove any potential harmful operations
-    dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE', 'GRANT', 'REVOKE']
     sql_upper = sql.upper()
     
-    for keyword in dangerous_keywords:
-        if re.search(r'\b' + keyword + r'\b', sql_upper):
-            return {
-                "valid": False,
-                "error": f"Dangerous operation detected: {keyword}"
-            }
+    # Remove any potential harmful operations; injection tokens are
+    # remembered and reported after the structural checks below
+    injection_token = None
+    for match in _DANGER_RE.finditer(sql_upper):
+        token = match.group(0)
+        if token in _INJECTION_TOKENS:
+            injection_token = injection_token or token
+            continue
+        return {
+            "valid": False,
+            "error": f"Dangerous operation detected: {token}"
+        }
     
     # Ensure it's a SELECT query
     if not sql_upper.strip().startswith('SELECT'):
@@ -236,7 +332,7 @@ def validate_sql(sql: str) -> Dict[str, Any]:
         }
     
     # Basic SQL injection prevention
-    if re.search(r'(;|\bEXEC\b|\bEXECUTE\b)', sql_upper):
+    if injection_token:
         return {
             "valid": False,
             "error": "Potential SQL injection detected"
@@ -247,28 +343,145 @@ def validate_sql(sql: str) -> Dict[str, Any]:
 def extract_sql_from_response(response: str) -> str:
     """Extract SQL from model response"""
     
+    # Fast path: the model usually answers with a bare SELECT statement
+    stripped = response.strip()
+    if stripped[:6].upper() == "SELECT":
+        end = stripped.find(";")
+        if end != -1:
+            return stripped[:end + 1].strip()
+        end = stripped.find("\n\n")
+        return (stripped[:end] if end != -1 else stripped).strip()
+    
     # Try to find SQL between markers
-    sql_match = re.search(r'```sql\n(.*?)\n```', response, re.DOTALL | re.IGNORECASE)
+    sql_match = _SQL_FENCE_RE.search(response)
     if sql_match:
         return sql_match.group(1).strip()
     
     # Try to find SQL after "SQL:" marker
-    sql_match = re.search(r'SQL:\s*(.*?)(?:\n\n|$)', response, re.DOTALL)
+    sql_match = _SQL_MARKER_RE.search(response)
     if sql_match:
         return sql_match.group(1).strip()
     
     # If no markers, look for SELECT statement
-    sql_match = re.search(r'(SELECT\s+.*?)(?:\n\n|$)', response, re.DOTALL | re.IGNORECASE)
+    sql_match = _SELECT_RE.search(response)
     if sql_match:
         return sql_match.group(1).strip()
     
     # Return the whole response if no SQL found
     return response.strip()
 
-def handler(job):
+def generate_batch(
+    prompts: List[str],
+    max_tokens: int,
+    sampling_kwargs: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Run one padded generate call for a batch of prompts"""
+    
+    # Tokenize
+    inputs_encoded = tokenizer(
+        prompts,
+        return_tensors="pt",
+        max_length=2048,
+        truncation=True,
+        padding=True
+    )
+    input_len = inputs_encoded["input_ids"].shape[1]
+    prompt_tokens = inputs_encoded["attention_mask"].sum(dim=1).tolist()
+    
+    # Move to device
+    inputs_encoded = {k: v.to(model_device, non_blocking=True) for k, v in inputs_encoded.items()}
+    
+    # Generate SQL
+    logger.info(f"Generating SQL for batch of {len(prompts)}...")
+    gpu_time_ms = None
+    if model_is_cuda:
+        # Wall-clock misses host/device overlap; time the GPU with events
+        start_event = torch.cuda.Event(enable_timing=True)
+        end_event = torch.cuda.Event(enable_timing=True)
+        start_event.record()
+    with torch.inference_mode():
+        outputs = model.generate(
+            **inputs_encoded,
+            generation_config=generation_config,
+            max_new_tokens=max_tokens,
+            **sampling_kwargs,
+        )
+    if model_is_cuda:
+        end_event.record()
+        torch.cuda.synchronize()
+        gpu_time_ms = start_event.elapsed_time(end_event)
+    
+    # Decode only the newly generated tail, not the echoed prompt
+    new_tokens = outputs[:, input_len:]
+    generated_tokens = (new_tokens != tokenizer.pad_token_id).sum(dim=1).tolist()
+    responses = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    
+    return [
+        {
+            "generated_text": response.strip(),
+            "prompt_tokens": prompt_tokens[i],
+            "generated_tokens": generated_tokens[i],
+            "gpu_time_ms": gpu_time_ms,
+        }
+        for i, response in enumerate(responses)
+    ]
+
+async def run_batch_worker():
+    """Collect queued generation requests into batches and run them"""
+    
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await request_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_SECONDS
+        while len(batch) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(request_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # Only requests with identical generation parameters can share a call
+        groups: Dict[tuple, List[tuple]] = {}
+        for prompt, params, future in batch:
+            groups.setdefault(params, []).append((prompt, future))
+        
+        for (max_tokens, sampling_items), items in groups.items():
+            prompts = [prompt for prompt, _ in items]
+            try:
+                results = await asyncio.to_thread(
+                    generate_batch, prompts, max_tokens, dict(sampling_items)
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+async def submit_generation(
+    prompt: str,
+    max_tokens: int,
+    sampling_kwargs: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Queue a prompt for batched generation and wait for its result"""
+    global batch_worker
+    
+    if batch_worker is None or batch_worker.done():
+        batch_worker = asyncio.create_task(run_batch_worker())
+    
+    future = asyncio.get_running_loop().create_future()
+    params = (max_tokens, tuple(sorted(sampling_kwargs.items())))
+    await request_queue.put((prompt, params, future))
+    return await future
+
+async def handler(job):
     """RunPod handler function"""
     
-    start_time = datetime.now()
+    start_time = time.perf_counter()
     logger.info("IASOQL handler called - Processing healthcare SQL query")
     
     try:
@@ -278,7 +491,9 @@ def handler(job):
         
         # Load model if not already loaded
         if model is None:
-            load_model()
+            async with model_load_lock:
+                if model is None:
+                    await asyncio.to_thread(load_model)
         
         # Extract inputs
         job_input = job['input']
@@ -297,6 +512,11 @@ def handler(job):
         max_tokens = job_input.get("max_tokens", 512)
         top_p = job_input.get("top_p", 0.95)
         
+        # Only sample when the caller asks for real randomness
+        sampling_kwargs = {}
+        if temperature > SAMPLING_TEMPERATURE_THRESHOLD:
+            sampling_kwargs = {"do_sample": True, "temperature": temperature, "top_p": top_p}
+        
         # Default schema if not provided
         if not schema_context:
             schema_context = """
@@ -319,36 +539,15 @@ Indexes: tenant_id, resource_type, resource_id, created_at
         
         logger.info(f"Processing query: {query[:100]}...")
         
-        # Tokenize
-        inputs_encoded = tokenizer(
-            prompt,
-            return_tensors="pt",
-            max_length=2048,
-            truncation=True,
-            padding=True
-        )
-        
-        # Move to device
-        if next(model.parameters()).is_cuda:
-            inputs_encoded = {k: v.cuda() for k, v in inputs_encoded.items()}
-        
-        # Generate SQL
-        logger.info("Generating SQL...")
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs_encoded,
-                generation_config=generation_config,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-            )
-        
-        # Decode response
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Generate SQL, batched with any concurrent jobs
+        generation = await submit_generation(prompt, max_tokens, sampling_kwargs)
         
         # Extract SQL from response
-        generated_text = response[len(prompt):].strip()
-        sql = extract_sql_from_response(generated_text)
+        sql = extract_sql_from_response(generation["generated_text"])
+        # Generation stops on the statement terminator; drop it so it isn't
+        # mistaken for a stacked query by validate_sql
+        if sql.endswith(";"):
+            sql = sql[:-1].rstrip()
         
         logger.info(f"Generated SQL: {sql[:200]}...")
         
@@ -361,11 +560,11 @@ Indexes: tenant_id, resource_type, resource_id, created_at
                 "generated_sql": sql,
                 "status": "invalid",
                 "query": query,
-                "execution_time": (datetime.now() - start_time).total_seconds()
+                "execution_time": time.perf_counter() - start_time
             }
         
         # Clear GPU cache
-        if torch.cuda.is_available():
+        if model_is_cuda:
             torch.cuda.empty_cache()
         
         # Return results
@@ -377,9 +576,10 @@ Indexes: tenant_id, resource_type, resource_id, created_at
                 "model": MODEL_NAME,
                 "rag_context_provided": bool(rag_context),
                 "examples_provided": len(examples) > 0,
-                "execution_time": (datetime.now() - start_time).total_seconds(),
-                "prompt_tokens": len(inputs_encoded["input_ids"][0]),
-                "generated_tokens": len(outputs[0]) - len(inputs_encoded["input_ids"][0])
+                "execution_time": time.perf_counter() - start_time,
+                "prompt_tokens": generation["prompt_tokens"],
+                "generated_tokens": generation["generated_tokens"],
+                "gpu_time_ms": generation["gpu_time_ms"]
             }
         }
         
@@ -389,7 +589,7 @@ Indexes: tenant_id, resource_type, resource_id, created_at
         return {
             "error": "GPU out of memory. Try reducing max_tokens or query length.",
             "status": "error",
-            "execution_time": (datetime.now() - start_time).total_seconds()
+            "execution_time": time.perf_counter() - start_time
         }
         
     except Exception as e:
@@ -397,10 +597,18 @@ Indexes: tenant_id, resource_type, resource_id, created_at
         return {
             "error": str(e),
             "status": "error",
-            "execution_time": (datetime.now() - start_time).total_seconds()
+            "execution_time": time.perf_counter() - start_time
         }
 
 # Start RunPod serverless handler
 if __name__ == "__main__":
     logger.info("Starting IASOQL RunPod handler...")
-    runpod.serverless.start({"handler": handler})
\ No newline at end of file
+    # Optionally load the model before taking jobs so the first request
+    # doesn't pay the model-load cost
+    if os.environ.get("RUNPOD_PREWARM", "0") == "1":
+        load_model()
+    runpod.serverless.start({
+        "handler": handler,
+        # Let RunPod hand us enough concurrent jobs to fill a batch
+        "concurrency_modifier": lambda current_concurrency: MAX_BATCH_SIZE,
+    })
\ No newline at end of file